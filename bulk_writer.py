@@ -0,0 +1,80 @@
+import time
+from itertools import count
+
+from pymongo.errors import BulkWriteError
+
+import metrics
+
+
+class BulkWriter:
+    # Копит операции и отправляет их одним bulk_write(ordered=False).
+    # depends_on - буфер, который обязан записаться раньше этого
+    # (прогресс обхода не должен обгонять сами страницы).
+    # tag - метка операции (например, url страницы), по которой pending()
+    # говорит, что операция ещё в буфере и в коллекции её не видно.
+    def __init__(self, collection, max_ops=500, max_delay=2.0, depends_on=None):
+        self.collection = collection
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self.depends_on = depends_on
+
+        self.ops = {}
+        self.tags = set()
+        self.seq = count()
+        self.last_flush = time.monotonic()
+
+        self.written = 0
+        self.errors = 0
+
+    def add(self, op, key=None, tag=None):
+        # операция с тем же key заменяет предыдущую (например, курсор задачи)
+        if key is None:
+            key = next(self.seq)
+        else:
+            self.ops.pop(key, None)
+        self.ops[key] = op
+        if tag is not None:
+            self.tags.add(tag)
+
+        if len(self.ops) >= self.max_ops or time.monotonic() - self.last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self.depends_on is not None:
+            self.depends_on.flush()
+
+        self.last_flush = time.monotonic()
+        if not self.ops:
+            return
+
+        ops = list(self.ops.values())
+        self.ops.clear()
+        self.tags.clear()
+
+        name = self.collection.name
+        try:
+            with metrics.timer("upsert", collection=name):
+                self.collection.bulk_write(ops, ordered=False)
+            self.written += len(ops)
+            metrics.inc("bulk_ops", len(ops), collection=name)
+        except BulkWriteError as e:
+            failed = e.details.get("writeErrors", [])
+            self.errors += len(failed)
+            metrics.inc("bulk_errors", len(failed), collection=name)
+            self.written += len(ops) - len(failed)
+            for err in failed[:5]:
+                print(f"[BULK ERROR] {self.collection.name}: {err.get('errmsg')}")
+
+    def pending(self, tags) -> bool:
+        return not self.tags.isdisjoint(tags)
+
+    def __getattr__(self, name):
+        # чтение (find, count_documents, ...) идёт напрямую в коллекцию
+        # и не видит ещё не сброшенные операции
+        return getattr(self.collection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
@@ -1,17 +1,17 @@
-import sys
 import time
-import hashlib
+import asyncio
+import argparse
 import yaml
-import requests
 import re
-import requests
-import time
-import urllib3
 from urllib.parse import urlparse, urlunparse, urljoin, unquote, quote
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, UpdateMany
 from bs4 import BeautifulSoup
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import metrics
+from bulk_writer import BulkWriter
+from fetcher import Fetcher
+from frontier import Frontier
+from htmlstore import BLOBS_COLLECTION, ZSTD_LEVEL, HtmlStore, content_hash as html_hash
 
 def normalize_url(url: str) -> str:
     p = urlparse(url.strip())
@@ -23,28 +23,112 @@ def normalize_url(url: str) -> str:
     return urlunparse((p.scheme, netloc, path, p.params, p.query, ""))
 
 
-def save_article(pages, url, html, source):
-    ts = int(time.time())
-    content_hash = hashlib.sha256(html.encode("utf-8", errors="ignore")).hexdigest()
-
-    old = pages.find_one({"url": url})
-    if old and old.get("content_hash") == content_hash:
-        pages.update_one({"url": url}, {"$set": {"fetched_at": ts}})
-        print("Not changed:", url)
-        return
-
-    pages.update_one(
-        {"url": url},
-        {"$set": {
-            "url": url,
-            "html": html,
-            "source": source,
-            "fetched_at": ts,
-            "content_hash": content_hash
-        }},
-        upsert=True
-    )
-    print("Saved:", url)
+# old - уже известный документ страницы (load_known), чтобы не делать find_one на каждую.
+# Сам html уходит сжатым в blobs (htmlstore.py), в pages - только content_hash.
+def save_article(pages, store, url, html, source, old=None, extra=None):
+    with metrics.timer("save", source=source):
+        ts = int(time.time())
+        with metrics.timer("hash"):
+            content_hash = html_hash(html)
+        extra = extra or {}
+
+        if old and old.get("content_hash") == content_hash:
+            pages.add(UpdateOne({"url": url}, {"$set": {"fetched_at": ts, **extra}}), tag=url)
+            print("Not changed:", url)
+            metrics.inc("pages_unchanged", source=source)
+            return False
+
+        store.put(source, content_hash, html)
+        pages.add(UpdateOne(
+            {"url": url},
+            {
+                "$set": {
+                    "url": url,
+                    "source": source,
+                    "fetched_at": ts,
+                    "content_hash": content_hash,
+                    **extra
+                },
+                # html старого формата, если страница хранила его inline
+                "$unset": {"html": ""}
+            },
+            upsert=True
+        ), tag=url)
+        print("Saved:", url)
+        metrics.inc("pages_saved", source=source)
+        return old is None
+
+
+# Счётчик документов по источникам для проверки limits без count_documents
+# на каждую статью. Общий для всех воркеров: документ docs:<source> в state,
+# новые страницы прибавляются $inc. Раз в reconcile_every секунд воркер
+# пересчитывает его по pages (удалённые страницы, сбои записи); между
+# сверками он может отстать не больше чем на несброшенные буферы других
+# воркеров.
+COUNTER_PREFIX = "docs:"
+
+
+class SourceCounter:
+    def __init__(self, pages, state, reconcile_every=600):
+        self.pages = pages
+        self.state = state
+        self.reconcile_every = reconcile_every
+        self.reconcile()
+
+    def reconcile(self):
+        # буфер должен быть записан, иначе новые страницы не попадут в подсчёт
+        self.pages.flush()
+        names = []
+        for row in self.pages.aggregate([{"$group": {"_id": "$source", "n": {"$sum": 1}}}]):
+            names.append(COUNTER_PREFIX + str(row["_id"]))
+            self.state.update_one({"name": names[-1]}, {"$set": {"n": row["n"]}}, upsert=True)
+        self.state.update_many(
+            {"name": {"$regex": f"^{COUNTER_PREFIX}", "$nin": names}},
+            {"$set": {"n": 0}}
+        )
+        self.reconciled_at = time.monotonic()
+
+    def get(self, source: str) -> int:
+        if time.monotonic() - self.reconciled_at >= self.reconcile_every:
+            self.reconcile()
+        doc = self.state.find_one({"name": COUNTER_PREFIX + source}, {"n": 1})
+        return doc["n"] if doc else 0
+
+    def add(self, source: str):
+        self.state.update_one({"name": COUNTER_PREFIX + source}, {"$inc": {"n": 1}}, upsert=True)
+
+
+def touch_article(pages, url):
+    pages.add(UpdateOne({"url": url}, {"$set": {"fetched_at": int(time.time())}}), tag=url)
+    print("Not modified (304):", url)
+
+
+KNOWN_FIELDS = {"url": 1, "content_hash": 1, "revid": 1, "etag": 1, "last_modified": 1}
+
+
+def load_known(pages, urls) -> dict:
+    # страница, сохранённая недавно (url повторился на сдвинувшейся странице
+    # списка), может ещё лежать в буфере - тогда сначала сбрасываем его
+    urls = list(urls)
+    if pages.pending(urls):
+        pages.flush()
+    return {
+        doc["url"]: doc
+        for doc in pages.find({"url": {"$in": urls}}, KNOWN_FIELDS)
+    }
+
+
+def conditional_headers(doc) -> dict:
+    headers = {}
+    if doc and doc.get("etag"):
+        headers["If-None-Match"] = doc["etag"]
+    if doc and doc.get("last_modified"):
+        headers["If-Modified-Since"] = doc["last_modified"]
+    return headers
+
+
+def response_validators(r) -> dict:
+    return {"etag": r.etag, "last_modified": r.last_modified}
 
 HEADERS = {
     "User-Agent": "WikiCrawler/1.0 (educational project)"
@@ -60,152 +144,194 @@ def normalize_title(title: str) -> str:
     return title.replace(" ", "_")
 
 
-def fetch_wiki_html(title: str) -> str | None:
+async def fetch_wiki_html(fetcher, title: str, revid: int | None = None) -> str | None:
     safe = quote(title)
 
+    # html конкретной ревизии - ровно то, что вернул список категории
     rest_url = f"https://ru.wikipedia.org/api/rest_v1/page/html/{safe}"
-    try:
-        r = requests.get(rest_url, headers=HEADERS, timeout=10)
-        if r.status_code == 200:
-            return r.text
-    except:
-        pass
+    if revid:
+        rest_url += f"/{revid}"
+    r = await fetcher.get(rest_url, headers=HEADERS)
+    if r and r.status == 200:
+        return r.text
 
     classic_url = f"https://ru.wikipedia.org/wiki/{safe}"
-    try:
-        r = requests.get(classic_url, headers=HEADERS, timeout=10)
-        if r.status_code == 200:
-            return r.text
-    except:
-        pass
+    r = await fetcher.get(classic_url, headers=HEADERS)
+    if r and r.status == 200:
+        return r.text
 
     return None
 
 
-def get_category_members(category_title: str):
+async def get_category_members(fetcher, category_title: str, cont: dict | None = None):
+    # по одной странице ответа API: (cont, участники), где cont - параметры
+    # continue, которыми эта страница запрашивается (None - первая)
     category_title = normalize_title(category_title)
     full_title = f"Категория:{category_title}"
 
+    # generator + prop=info: за один запрос получаем до 500 участников
+    # категории сразу с lastrevid, без отдельного запроса на каждую статью
     params = {
         "action": "query",
-        "list": "categorymembers",
-        "cmtitle": full_title,
-        "cmtype": "page|subcat",
-        "cmlimit": 500,
-        "format": "json"
+        "generator": "categorymembers",
+        "gcmtitle": full_title,
+        "gcmtype": "page|subcat",
+        "gcmlimit": 500,
+        "prop": "info",
+        "format": "json",
+        "formatversion": 2
     }
 
-    members = []
-    session = requests.Session()
+    if cont:
+        params.update(cont)
 
     while True:
-        r = session.get(API_URL, params=params, headers=HEADERS, timeout=10)
-        r.raise_for_status()
-        data = r.json()
+        data = await fetcher.get_json(API_URL, params=params, headers=HEADERS)
 
-        members.extend(data["query"]["categorymembers"])
+        # порядок внутри ответа не гарантирован, а cursor - индекс в странице
+        members = sorted(data.get("query", {}).get("pages", []), key=lambda m: m["title"])
+        yield cont, members
 
         if "continue" not in data:
             break
 
-        params.update(data["continue"])
-
-    return members
+        cont = data["continue"]
+        params.update(cont)
 
 
-def crawl_wikipedia(cfg, pages, queue, headers):
-    delay = cfg["logic"].get("delay", 0.5)
+async def crawl_wikipedia(cfg, pages, store, queue, frontier, fetcher, counter):
     max_docs = cfg.get("limits", {}).get("wikipedia")
     max_depth = cfg["logic"].get("max_depth", 8)
+    batch = cfg["logic"].get("concurrency", 8)
 
-    task = queue.find_one_and_update(
-        {"status": "pending", "source": "wikipedia"},
-        {"$set": {"status": "processing"}}
-    )
+    task = frontier.claim("wikipedia")
 
     if not task:
         return False
 
     title = normalize_title(task["title"])
     depth = task.get("depth", 0)
-    cursor = task.get("cursor", 0)
 
-    print(f"\n[WIKI] category={title} depth={depth} cursor={cursor}")
-
-    try:
-        members = get_category_members(title)
+    # позиция: continue-параметры страницы API и индекс в ней; у задач старого
+    # формата cursor - индекс в полном списке, такие начинаем сначала
+    cont = task.get("cont")
+    cursor = task.get("cursor", 0) if "cont" in task else 0
 
-        total = len(members)
-        print(f"    found {total} members")
+    print(f"\n[WIKI] category={title} depth={depth} cont={cont} cursor={cursor} worker={frontier.worker_id}")
 
-        for i in range(cursor, total):
-            time.sleep(delay)
-
-            m = members[i]
-
-            queue.update_one(
-                {"_id": task["_id"]},
-                {"$set": {"cursor": i}}
-            )
+    # пока категория обходится, аренда продлевается в фоне
+    heartbeat = asyncio.create_task(frontier.keep_alive(task))
 
-            # Статья
-            if m["ns"] == 0:
-                if max_docs:
-                    count = pages.count_documents({"source": "wikipedia"})
+    try:
+        # участники идут страницами по 500, в памяти только текущая;
+        # при возобновлении - один запрос к сохранённой странице
+        async for cont, members in get_category_members(fetcher, title, cont):
+            total = len(members)
+            print(f"    page of {total} members")
+
+            for start in range(cursor, total, batch):
+                if heartbeat.done():
+                    # задачу забрал другой воркер - дальше не качаем
+                    print(f"[WIKI] lease lost, leaving category={title}")
+                    return True
+
+                chunk = members[start:start + batch]
+                articles = []
+
+                for i, m in enumerate(chunk, start):
+                    # Статья
+                    if m["ns"] == 0:
+                        page_title = normalize_title(m["title"])
+                        url = f"https://ru.wikipedia.org/wiki/{page_title}"
+                        articles.append((i, url, page_title, m.get("lastrevid")))
+
+                    # Подкатегория
+                    elif m["ns"] == 14 and depth < max_depth:
+                        subcat = normalize_title(m["title"])
+
+                        print(f"    [{i+1}/{total}] SUBCATEGORY {subcat}")
+
+                        queue.add(UpdateOne(
+                            {"title": subcat, "source": "wikipedia"},
+                            {"$setOnInsert": {
+                                "title": subcat,
+                                "source": "wikipedia",
+                                "status": "pending",
+                                "depth": depth + 1,
+                                "cont": None,
+                                "cursor": 0
+                            }},
+                            upsert=True
+                        ))
+
+                # курсор встаёт за последним обработанным участником; статьи,
+                # отрезанные лимитом, достанутся следующему запуску
+                done = start + len(chunk)
+
+                if articles and max_docs:
+                    count = counter.get("wikipedia")
                     if count >= max_docs:
                         print(f"[WIKI] Limit reached: {count}/{max_docs}")
+                        queue.flush()
+                        frontier.release(task)
                         return False
-
-                page_title = normalize_title(m["title"])
-                url = f"https://ru.wikipedia.org/wiki/{page_title}"
-
-                print(f"    [{i+1}/{total}] ARTICLE {page_title}")
-
-                html = fetch_wiki_html(page_title)
-                if not html:
-                    print(f"        FAIL")
-                    continue
-
-                save_article(pages, url, html, "wikipedia")
-
-            # Подкатегория
-            elif m["ns"] == 14 and depth < max_depth:
-                subcat = normalize_title(m["title"])
-
-                print(f"    [{i+1}/{total}] SUBCATEGORY {subcat}")
-
-                queue.update_one(
-                    {"title": subcat, "source": "wikipedia"},
-                    {"$setOnInsert": {
-                        "title": subcat,
-                        "source": "wikipedia",
-                        "status": "pending",
-                        "depth": depth + 1,
-                        "cursor": 0
-                    }},
-                    upsert=True
+                    if len(articles) > max_docs - count:
+                        articles = articles[:max_docs - count]
+                        done = articles[-1][0] + 1
+
+                # ревизия не изменилась - статью не скачиваем вовсе
+                known = load_known(pages, (url for _, url, _, _ in articles))
+                unchanged = {
+                    url for _, url, _, revid in articles
+                    if revid and known.get(url, {}).get("revid") == revid
+                }
+                if unchanged:
+                    pages.add(UpdateMany(
+                        {"url": {"$in": list(unchanged)}},
+                        {"$set": {"fetched_at": int(time.time())}}
+                    ))
+
+                to_fetch = [a for a in articles if a[1] not in unchanged]
+
+                # статьи пачки качаются параллельно, темп задаёт token-bucket хоста
+                htmls = await asyncio.gather(*(fetch_wiki_html(fetcher, t, rev) for _, _, t, rev in to_fetch))
+                fetched = {url: html for (_, url, _, _), html in zip(to_fetch, htmls)}
+
+                for i, url, page_title, revid in articles:
+                    print(f"    [{i+1}/{total}] ARTICLE {page_title}")
+
+                    if url in unchanged:
+                        print("Not changed (revid):", url)
+                        continue
+
+                    html = fetched[url]
+                    if not html:
+                        print(f"        FAIL")
+                        continue
+
+                    if save_article(pages, store, url, html, "wikipedia", known.get(url), {"revid": revid}):
+                        counter.add("wikipedia")
+
+                # курсор пишется только после страниц (queue зависит от буфера pages)
+                queue.add(
+                    UpdateOne(frontier.owned(task), {"$set": {"cont": cont, "cursor": done}}),
+                    key=("cursor", task["_id"])
                 )
 
-        queue.update_one(
-            {"_id": task["_id"]},
-            {"$set": {
-                "status": "done",
-                "cursor": 0,
-                "last_crawled": int(time.time())
-            }}
-        )
+            cursor = 0
+
+        queue.flush()
+        frontier.complete(task, {"cont": None, "cursor": 0})
 
         print(f"[WIKI] finished category={title}")
         return True
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\n[WIKI] Ctrl+C received")
 
         # возвращаем задачу обратно в очередь
-        queue.update_one(
-            {"_id": task["_id"]},
-            {"$set": {"status": "pending"}}
-        )
+        queue.flush()
+        frontier.release(task)
 
         raise
 
@@ -213,13 +339,14 @@ def crawl_wikipedia(cfg, pages, queue, headers):
         print(f"[WIKI ERROR] {e}")
 
         # при любой ошибке тоже возвращаем задачу в pending
-        queue.update_one(
-            {"_id": task["_id"]},
-            {"$set": {"status": "pending"}}
-        )
+        queue.flush()
+        frontier.release(task)
 
         return True
 
+    finally:
+        heartbeat.cancel()
+
 def is_securitylab_article(url: str) -> bool:
     parsed = urlparse(url)
 
@@ -273,123 +400,224 @@ def extract_securitylab_news(html):
     return links
 
 
-def crawl_securitynews(cfg, pages, state, headers, max_pages=1800):
-    delay = cfg["logic"].get("delay", 0.8)
-    max_docs = cfg.get("limits", {}).get("securitynews")
 
-    progress = state.find_one({"name": "securitynews"}) or {"page": 1, "index": 0}
+def worker_slot(cfg) -> tuple[int, int]:
+    worker = cfg.get("worker", {})
+    return worker.get("index", 0), max(worker.get("count", 1), 1)
+
+
+def progress_name(cfg, name: str) -> str:
+    # у каждого воркера свой прогресс; при одном воркере - прежнее имя
+    slot, workers = worker_slot(cfg)
+    return name if workers == 1 else f"{name}@{slot}/{workers}"
+
+
+async def crawl_securitylab_section(cfg, pages, store, state, fetcher, counter, name, section, extract, max_pages, encoding=None):
+    max_docs = cfg.get("limits", {}).get(name)
+    batch = cfg["logic"].get("concurrency", 8)
+
+    # страницы списка делятся между воркерами через одну: воркер slot из workers
+    # берёт slot+1, slot+1+workers, ... - так свежие первые страницы достаются
+    # всем поровну, даже если реальных страниц меньше max_pages
+    slot, workers = worker_slot(cfg)
+    key = progress_name(cfg, name)
+
+    progress = state.find_one({"name": key}) or {"page": slot + 1, "index": 0}
     page = progress["page"]
     start_index = progress["index"]
 
-    print(f"[RESUME] securitynews page={page}, index={start_index}")
+    print(f"[RESUME] {key} page={page}, index={start_index}")
 
-    try:
-        for p in range(page, max_pages + 1):
+    for p in range(page, max_pages + 1, workers):
 
-            url = f"https://www.securitylab.ru/news/page1_{p}.php"
-            print(f"\n[PAGE {p}] {url}")
+        url = f"https://www.securitylab.ru/{section}/page1_{p}.php"
+        print(f"\n[{name.upper()} PAGE {p}] {url}")
 
-            r = requests.get(url, headers=headers, timeout=10, verify=False)
-            if r.status_code != 200:
-                print(f"[HTTP {r.status_code}] stopping crawl")
-                return
+        r = await fetcher.get(url, verify=False, encoding="utf-8")
+        if r is None or r.status != 200:
+            print(f"[HTTP {r.status if r else 'error'}] stopping crawl")
+            return
 
-            r.encoding = "utf-8"
-            html = r.text
-            articles = list(extract_securitylab_news(html))
+        articles = list(extract(r.text))
 
-            print(f"  found articles: {len(articles)}")
+        print(f"  found articles: {len(articles)}")
 
-            for i in range(start_index, len(articles)):
-                if max_docs:
-                    count = pages.count_documents({"source": "securitynews"})
-                    if count >= max_docs:
-                        print(f"[SECURITYNEWS] Limit reached: {count}/{max_docs}")
-                        return
+        for start in range(start_index, len(articles), batch):
+            chunk = articles[start:start + batch]
 
-                article = articles[i]
-                print(f"    [{p}:{i}] {article}")
+            if max_docs:
+                count = counter.get(name)
+                if count >= max_docs:
+                    print(f"[{name.upper()}] Limit reached: {count}/{max_docs}")
+                    return
+                chunk = chunk[:max_docs - count]
 
-                r2 = requests.get(article, headers=headers, timeout=10, verify=False)
-                if r2.status_code == 200:
-                    r2.encoding = "utf-8"
-                    save_article(pages, article, r2.text, "securitynews")
+            known = load_known(pages, chunk)
+            responses = await asyncio.gather(*(
+                fetcher.get(a, headers=conditional_headers(known.get(a)), verify=False, encoding=encoding)
+                for a in chunk
+            ))
 
-                state.update_one(
-                    {"name": "securitynews"},
-                    {"$set": {"page": p, "index": i + 1}},
-                    upsert=True
-                )
+            for i, (article, r2) in enumerate(zip(chunk, responses), start):
+                print(f"    [{p}:{i}] {article}")
 
-                time.sleep(delay)
+                if r2 is None:
+                    continue
+                if r2.status == 304:
+                    touch_article(pages, article)
+                elif r2.status == 200:
+                    if save_article(pages, store, article, r2.text, name, known.get(article), response_validators(r2)):
+                        counter.add(name)
+
+            state.add(
+                UpdateOne({"name": key}, {"$set": {"page": p, "index": start + len(chunk)}}, upsert=True),
+                key=key
+            )
 
-            start_index = 0
+        start_index = 0
 
-    except KeyboardInterrupt:
+
+async def crawl_securitynews(cfg, pages, store, state, fetcher, counter, max_pages=1800):
+    try:
+        await crawl_securitylab_section(
+            cfg, pages, store, state, fetcher, counter, "securitynews", "news",
+            extract_securitylab_news, max_pages, encoding="utf-8"
+        )
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\n[STOP] Ctrl+C received. Progress already saved. Safe to restart.")
-        return
+        raise
+
+
+async def crawl_securityarticles(cfg, pages, store, state, fetcher, counter, max_pages=60):
+    try:
+        await crawl_securitylab_section(
+            cfg, pages, store, state, fetcher, counter, "securitylab", "analytics",
+            extract_securitylab_articles, max_pages
+        )
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("\n[STOP] SecurityLab interrupted. Progress saved.")
+        raise
 
 
-def crawl_securityarticles(cfg, pages, state, headers, max_pages=60):
-    delay = cfg["logic"].get("delay", 0.8)
-    max_docs = cfg.get("limits", {}).get("securitylab")
+async def recrawl_securitylab(cfg, pages, store, state, fetcher, source):
+    recrawl_after = cfg["logic"].get("recrawl_after_seconds", 400000)
+    threshold = int(time.time()) - recrawl_after
+    batch = cfg["logic"].get("concurrency", 8)
 
-    progress = state.find_one({"name": "securitylab"}) or {"page": 1, "index": 0}
-    page = progress["page"]
-    start_index = progress["index"]
+    # устаревшие страницы делятся между воркерами по порядку url
+    slot, workers = worker_slot(cfg)
+    stale = list(pages.find(
+        {"source": source, "fetched_at": {"$lt": threshold}},
+        KNOWN_FIELDS
+    ).sort("url", 1))[slot::workers]
+    force = progress_name(cfg, f"{source}_force")
 
-    print(f"[RESUME] securitylab page={page}, index={start_index}")
+    for start in range(0, len(stale), batch):
+        chunk = stale[start:start + batch]
 
-    try:
-        for p in range(page, max_pages + 1):
+        for doc in chunk:
+            print(f"[SECURITYLAB RECRAWL] scheduled: {doc['url']}")
+
+        state.add(
+            UpdateOne({"name": force}, {"$set": {"url": chunk[-1]["url"]}}, upsert=True),
+            key=force
+        )
 
-            url = f"https://www.securitylab.ru/analytics/page1_{p}.php"
-            print(f"\n[SECURITYLAB PAGE {p}] {url}")
+        # условный GET: неизменённая страница отвечает 304 без тела
+        responses = await asyncio.gather(*(
+            fetcher.get(doc["url"], headers=conditional_headers(doc), verify=False, encoding="utf-8")
+            for doc in chunk
+        ))
+
+        for doc, r in zip(chunk, responses):
+            url = doc["url"]
+            if r is None:
+                continue
+            if r.status == 304:
+                touch_article(pages, url)
+            elif r.status == 200:
+                save_article(pages, store, url, r.text, source, doc, response_validators(r))
+            else:
+                print(f"[SECURITYLAB RECRAWL] status {r.status}: {url}")
 
-            r = requests.get(url, headers=headers, timeout=10, verify=False)
-            if r.status_code != 200:
-                print(f"[HTTP {r.status_code}] stopping crawl")
-                return
-            r.encoding = "utf-8"
-            html = r.text
-            articles = list(extract_securitylab_articles(html))
+    if stale:
+        print(f"[INIT] Scheduled {len(stale)} {source} documents for recrawl")
 
-            print(f"  found articles: {len(articles)}")
 
-            for i in range(start_index, len(articles)):
-                if max_docs:
-                    count = pages.count_documents({"source": "securitylab"})
-                    if count >= max_docs:
-                        print(f"[SECURITYLAB] Limit reached: {count}/{max_docs}")
-                        return
+async def crawl_wikipedia_queue(cfg, pages, store, queue, frontier, fetcher, counter):
+    while True:
+        worked = await crawl_wikipedia(cfg, pages, store, queue, frontier, fetcher, counter)
+        if not worked:
+            print("\n[STOP] Wikipedia queue empty.")
+            break
 
-                article = articles[i]
-                print(f"    [{p}:{i}] {article}")
 
-                r2 = requests.get(article, headers=headers, timeout=10, verify=False)
-                if r2.status_code == 200:
-                    save_article(pages, article, r2.text, "securitylab")
+async def crawl_securitylab_all(cfg, pages, store, state, fetcher, counter):
+    await recrawl_securitylab(cfg, pages, store, state, fetcher, "securitynews")
+    await recrawl_securitylab(cfg, pages, store, state, fetcher, "securitylab")
 
-                state.update_one(
-                    {"name": "securitylab"},
-                    {"$set": {"page": p, "index": i + 1}},
-                    upsert=True
-                )
+    await crawl_securityarticles(cfg, pages, store, state, fetcher, counter)
+    await crawl_securitynews(cfg, pages, store, state, fetcher, counter)
 
-                time.sleep(delay)
 
-            start_index = 0
+async def run(cfg, pages, queue, state, frontier):
+    bulk_size = cfg["db"].get("bulk_size", 500)
+    bulk_interval = cfg["db"].get("bulk_interval", 2.0)
 
-    except KeyboardInterrupt:
-        print("\n[STOP] SecurityLab interrupted. Progress saved.")
-        return
+    # запись страниц и прогресса идёт через буферы bulk_write;
+    # страница пишется только после своего html в blobs
+    blobs = BulkWriter(pages.database[BLOBS_COLLECTION], bulk_size, bulk_interval)
+    store = HtmlStore(pages.database, cfg["db"].get("blob_level", ZSTD_LEVEL), blobs)
+    pages = BulkWriter(pages, bulk_size, bulk_interval, depends_on=blobs)
+    queue = BulkWriter(queue, bulk_size, bulk_interval, depends_on=pages)
+    state = BulkWriter(state, bulk_size, bulk_interval, depends_on=pages)
 
-def main():
+    counter = SourceCounter(pages, state, cfg["logic"].get("counter_reconcile_seconds", 600))
 
-    with open(sys.argv[1], "r", encoding="utf-8-sig") as f:
+    async with Fetcher(cfg) as fetcher:
+        try:
+            print("\n[START] Crawling started\n")
+
+            # разные хосты обходятся параллельно, каждый со своим темпом
+            await asyncio.gather(
+                crawl_securitylab_all(cfg, pages, store, state, fetcher, counter),
+                crawl_wikipedia_queue(cfg, pages, store, queue, frontier, fetcher, counter),
+            )
+        finally:
+            # в т.ч. при Ctrl+C: сначала страницы, потом прогресс
+            state.flush()
+            queue.flush()
+            fetcher.report()
+            metrics.stop()
+            metrics.report()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("config")
+    ap.add_argument("--worker-id", help="id воркера в очереди, по умолчанию host:pid")
+    ap.add_argument("--worker-index", type=int, help="номер воркера, 0..workers-1")
+    ap.add_argument("--workers", type=int, help="число воркеров, делящих securitylab")
+    args = ap.parse_args()
+
+    with open(args.config, "r", encoding="utf-8-sig") as f:
         cfg = yaml.safe_load(f)
 
-    client = MongoClient(cfg["db"]["uri"])
+    metrics_cfg = cfg.get("metrics", {})
+    metrics.start(metrics_cfg.get("path"), metrics_cfg.get("interval", 15))
+
+    worker = cfg.setdefault("worker", {})
+    if args.worker_id:
+        worker["id"] = args.worker_id
+    if args.worker_index is not None:
+        worker["index"] = args.worker_index
+    if args.workers is not None:
+        worker["count"] = args.workers
+    if not 0 <= worker.get("index", 0) < max(worker.get("count", 1), 1):
+        ap.error("worker index must be in [0, workers)")
+
+    # время запросов к Mongo по коллекциям - через command monitoring
+    client = MongoClient(cfg["db"]["uri"], event_listeners=[metrics.CommandTimer()])
     db = client[cfg["db"]["name"]]
 
     pages = db["pages"]
@@ -406,15 +634,13 @@ def main():
     queue.create_index("status")
     queue.create_index("source")
 
-    headers = {"User-Agent": cfg["logic"].get("user_agent", "IR-Crawler")}
-
+    frontier = Frontier(queue, worker.get("id"), cfg["logic"].get("lease_seconds", 300))
+    frontier.create_indexes()
 
-    restored = queue.update_many(
-        {"status": "processing", "source": "wikipedia"},
-        {"$set": {"status": "pending"}}
-    )
-    if restored.modified_count:
-        print(f"[INIT] Restored {restored.modified_count} wiki tasks")
+    # задачи живых воркеров не трогаем - только с истёкшей арендой
+    restored = frontier.reclaim("wikipedia")
+    if restored:
+        print(f"[INIT] Reclaimed {restored} expired wiki tasks")
 
 
     for seed in cfg.get("seeds", []):
@@ -431,6 +657,7 @@ def main():
                 "source": "wikipedia",
                 "status": "pending",
                 "depth": 0,
+                "cont": None,
                 "cursor": 0
             }},
             upsert=True
@@ -446,95 +673,28 @@ def main():
         parsed = urlparse(doc["url"])
         title = unquote(parsed.path.replace("/wiki/", ""))
 
-        queue.update_one(
-            {"title": title, "source": "wikipedia"},
-            {"$set": {"status": "pending"}},
-            upsert=True
+        # категорию, которую сейчас обходит другой воркер, не перехватываем
+        r = queue.update_one(
+            {"title": title, "source": "wikipedia", "status": {"$ne": "processing"}},
+            {"$set": {"status": "pending"}}
         )
+        if not r.matched_count:
+            queue.update_one(
+                {"title": title, "source": "wikipedia"},
+                {"$setOnInsert": {"status": "pending"}},
+                upsert=True
+            )
 
         recrawl_count += 1
 
     if recrawl_count:
         print(f"[INIT] Scheduled {recrawl_count} wikipedia docs for recrawl")
 
-    # Security News Recrawl
-    recrawl_after = cfg["logic"].get("recrawl_after_seconds", 400000)
-    threshold = int(time.time()) - recrawl_after
-
-    recrawl_count = 0
-
-    for doc in pages.find({"source": "securitynews", "fetched_at": {"$lt": threshold}}, {"url": 1}):
-        url = doc["url"]
-
-        print(f"[SECURITYLAB RECRAWL] scheduled: {url}")
-
-        state.update_one(
-            {"name": "securitynews_force"},
-            {"$set": {"url": url}},
-            upsert=True
-        )
-
-        try:
-            r = requests.get(url, headers=headers, timeout=10, verify=False)
-            if r.status_code == 200:
-                html = r.content.decode("utf-8", errors="replace")
-                save_article(pages, url, html, "securitynews")
-            else:
-                print(f"[SECURITYLAB RECRAWL] status {r.status_code}: {url}")
-
-        except Exception as e:
-            print(f"[SECURITYLAB RECRAWL] error for {url}: {e}")
-
-        time.sleep(cfg["logic"].get("delay", 0.8))
-        recrawl_count += 1
-
-    if recrawl_count:
-        print(f"[INIT] Scheduled {recrawl_count} securitynews documents for recrawl")
-
-
-    # Security Articles Recrawl
-    recrawl_after = cfg["logic"].get("recrawl_after_seconds", 400000)
-    threshold = int(time.time()) - recrawl_after
-
-    recrawl_count = 0
-
-    for doc in pages.find({"source": "securitylab", "fetched_at": {"$lt": threshold}}, {"url": 1}):
-        url = doc["url"]
-
-        print(f"[SECURITYLAB RECRAWL] scheduled: {url}")
-
-        state.update_one(
-            {"name": "securitylab_force"},
-            {"$set": {"url": url}},
-            upsert=True
-        )
-
-        r = requests.get(url, headers=headers, timeout=10, verify=False)
-        if r.status_code == 200:
-            r.encoding = "utf-8"
-            save_article(pages, url, r.text, "securitylab")
-
-        time.sleep(cfg["logic"].get("delay", 0.8))
-        recrawl_count += 1
-
-    if recrawl_count:
-        print(f"[INIT] Scheduled {recrawl_count} securityarticles documents for recrawl")
-
-
     try:
-        print("\n[START] Crawling started\n")
-
-        crawl_securityarticles(cfg, pages, state, headers)
-        crawl_securitynews(cfg, pages, state, headers)
-
-        while True:
-            worked = crawl_wikipedia(cfg, pages, queue, headers)
-            if not worked:
-                print("\n[STOP] Wikipedia queue empty.")
-                break
+        asyncio.run(run(cfg, pages, queue, state, frontier))
 
     except KeyboardInterrupt:
         print("\n[STOP] Interrupted by user. Safe to restart, progress saved.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
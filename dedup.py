@@ -0,0 +1,203 @@
+import hashlib
+import re
+import sys
+import time
+from array import array
+from operator import eq
+
+# Поиск почти-дубликатов (перепечатки новостей securitylab/securitynews,
+# одинаковые статьи Википедии под разными url) по MinHash + LSH.
+#
+# Документ - множество шинглов: хэшей от 5 подряд идущих слов текста.
+# Сходство двух документов - коэффициент Жаккара этих множеств. Сигнатура
+# строится одной перестановкой (one permutation hashing): хэш шингла
+# раскладывается на номер корзины и значение, в каждой из BINS корзин
+# остаётся минимум; пустые корзины заполняются значением ближайшей непустой
+# справа со сдвигом (densification). Доля совпавших корзин двух сигнатур -
+# оценка Жаккара, а стоит такая сигнатура один проход по шинглам вместо
+# BINS проходов классического MinHash.
+#
+# LSH: сигнатура режется на BANDS полос по ROWS корзин, документы с хотя бы
+# одной совпавшей полосой - кандидаты, и только для них считается оценка
+# сходства. Поиск стоит BANDS обращений к словарям плюс кандидаты, а не
+# проход по всему корпусу. При 24x5 пара с Жаккаром 0.7 становится
+# кандидатом с вероятностью 0.99, с Жаккаром 0.3 - с вероятностью 0.06.
+
+SHINGLE = 5
+BINS = 120
+BANDS = 24
+ROWS = BINS // BANDS
+THRESHOLD = 0.7
+
+HASH_BITS = 56
+EMPTY = (1 << 64) - 1
+
+WORD_RE = re.compile(r"\w+")
+
+
+def shingle_hashes(text: str, k: int = SHINGLE) -> set[int]:
+    words = WORD_RE.findall(text.lower())
+    if len(words) < k:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = (" ".join(words[i:i + k]) for i in range(len(words) - k + 1))
+
+    # blake2b, а не hash(): сигнатуры хранятся в базе и должны совпадать
+    # между процессами и запусками
+    return {
+        int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=HASH_BITS // 8).digest(), "little")
+        for g in grams
+    }
+
+
+def signature(text: str) -> array | None:
+    hashes = shingle_hashes(text)
+    if not hashes:
+        return None
+
+    sig = array("Q", [EMPTY]) * BINS
+    for h in hashes:
+        b = h % BINS
+        v = h // BINS
+        if v < sig[b]:
+            sig[b] = v
+
+    # пустая корзина берёт значение ближайшей непустой справа (по кругу),
+    # расстояние - в старших битах, чтобы не совпадать с настоящими минимумами
+    out = array("Q", sig)
+    nearest = None
+    for i in range(2 * BINS - 1, -1, -1):
+        if sig[i % BINS] != EMPTY:
+            nearest = i
+        elif i < BINS:
+            out[i] = sig[nearest % BINS] | (nearest - i) << HASH_BITS
+    return out
+
+
+def from_bytes(data: bytes) -> array:
+    sig = array("Q")
+    sig.frombytes(data)
+    return sig
+
+
+def similarity(a: array, b: array) -> float:
+    return sum(map(eq, a, b)) / BINS
+
+
+def band_keys(sig: array) -> list[int]:
+    return [hash(tuple(sig[i:i + ROWS])) for i in range(0, BINS, ROWS)]
+
+
+class NearDuplicates:
+    # индекс LSH в памяти; документы - номерами, в корзине полосы один номер
+    # или список, если документов с такой полосой несколько
+    def __init__(self, threshold: float = THRESHOLD):
+        self.threshold = threshold
+        self.urls: list[str] = []
+        self.sigs: list[array | None] = []
+        self.ids: dict[str, int] = {}
+        self.buckets: list[dict] = [{} for _ in range(BANDS)]
+
+        self.lookups = 0
+        self.candidates = 0
+        self.found = 0
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, url: str, sig: array):
+        # повторный add того же url заменяет сигнатуру; старые полосы остаются,
+        # но кандидаты всё равно сверяются с текущей сигнатурой
+        idx = self.ids.get(url)
+        if idx is None:
+            idx = self.ids[url] = len(self.urls)
+            self.urls.append(url)
+            self.sigs.append(sig)
+        else:
+            self.sigs[idx] = sig
+
+        for bucket, key in zip(self.buckets, band_keys(sig)):
+            cur = bucket.get(key)
+            if cur is None:
+                bucket[key] = idx
+            elif isinstance(cur, list):
+                if idx not in cur:
+                    cur.append(idx)
+            elif cur != idx:
+                bucket[key] = [cur, idx]
+
+    def discard(self, url: str):
+        # документ сам оказался дубликатом - оригиналом для других он не будет
+        idx = self.ids.get(url)
+        if idx is not None:
+            self.sigs[idx] = None
+
+    def find(self, url: str, sig: array) -> tuple[str, float] | None:
+        # самый похожий документ не ниже порога, сам url не в счёт
+        self.lookups += 1
+        seen = set()
+        best = None
+
+        for bucket, key in zip(self.buckets, band_keys(sig)):
+            cur = bucket.get(key)
+            if cur is None:
+                continue
+
+            for idx in cur if isinstance(cur, list) else (cur,):
+                if idx in seen:
+                    continue
+                seen.add(idx)
+                if self.sigs[idx] is None or self.urls[idx] == url:
+                    continue
+
+                self.candidates += 1
+                s = similarity(sig, self.sigs[idx])
+                if s >= self.threshold and (best is None or s > best[1]):
+                    best = (self.urls[idx], s)
+
+        if best:
+            self.found += 1
+        return best
+
+    def load(self, collection) -> int:
+        # сигнатуры уже разобранных документов из ir_corpus.docs
+        for doc in collection.find({"minhash": {"$exists": True}}, {"url": 1, "minhash": 1}, batch_size=5000):
+            self.add(doc["url"], from_bytes(doc["minhash"]))
+        return len(self.urls)
+
+    def stats(self) -> dict:
+        return {
+            "docs": sum(s is not None for s in self.sigs),
+            "lookups": self.lookups,
+            "candidates": self.candidates,
+            "candidates_per_lookup": self.candidates / max(self.lookups, 1),
+            "duplicates": self.found,
+        }
+
+
+def main():
+    # python dedup.py corpus.tsv [threshold] - сколько почти-дубликатов в выгрузке
+    path = sys.argv[1] if len(sys.argv) > 1 else "corpus.tsv"
+    threshold = float(sys.argv[2]) if len(sys.argv) > 2 else THRESHOLD
+
+    index = NearDuplicates(threshold)
+    start = time.perf_counter()
+
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            text = line.rstrip("\n").partition("\t")[2]
+            sig = signature(text)
+            if sig is None:
+                continue
+            if index.find(str(n), sig) is None:
+                index.add(str(n), sig)
+
+    seconds = time.perf_counter() - start
+    stats = index.stats()
+    print(f"Documents: {stats['lookups']}, unique: {stats['docs']}, near-duplicates: {stats['duplicates']}")
+    print(f"Candidates per lookup: {stats['candidates_per_lookup']:.2f}")
+    print(f"Time: {seconds:.2f} s, {stats['lookups'] / max(seconds, 1e-9):.0f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
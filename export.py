@@ -1,35 +1,224 @@
-from pymongo import MongoClient
+import argparse
+import gzip
+import json
+import os
+import time
 import unicodedata
+from calendar import timegm
+from datetime import datetime, timezone
 
-client = MongoClient("mongodb://localhost:27017")
-db = client["ir_corpus"]
-collection = db["docs"]
+from pymongo import MongoClient
 
-out = open("corpus.tsv", "w", encoding="utf-8")
+import metrics
 
-count = 0
+FLATTEN = str.maketrans({"\t": " ", "\n": " "})
 
-for doc in collection.find({}, {"title": 1, "summary": 1, "text": 1}):
-    doc_id = str(doc["_id"])
+SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
 
-    title = doc.get("title", "")
-    summary = doc.get("summary", "")
-    text = doc.get("text", "")
+# updated_at ставит сервер ($currentDate) при записи; запас - на записи,
+# которые ещё выполнялись в момент взятия водяного знака
+WATERMARK_SLACK = 60
 
-    title = title if title else ""
-    summary = summary if summary else ""
-    text = text if text else ""
 
-    full_text = title + "\n" + summary + "\n" + text
+def format_line(doc) -> str:
+    title = doc.get("title") or ""
+    summary = doc.get("summary") or ""
+    text = doc.get("text") or ""
 
-    full_text = full_text.replace("\t", " ")
-    full_text = full_text.replace("\n", " ")
+    full_text = f"{title}\n{summary}\n{text}".translate(FLATTEN)
     full_text = unicodedata.normalize("NFC", full_text)
-    out.write(doc_id + "\t" + full_text + "\n")
-    count += 1
+    return f"{doc['_id']}\t{full_text}\n"
+
+
+def shard_paths(out: str, shards: int, compress: str) -> list[str]:
+    suffix = SUFFIX[compress]
+    if shards == 1:
+        return [out + suffix]
+
+    base, ext = os.path.splitext(out)
+    return [f"{base}.{i:02d}{ext}{suffix}" for i in range(shards)]
+
+
+def open_shard(path: str, compress: str):
+    if compress == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)
+
+    if compress == "zstd":
+        import zstandard
+        fh = open(path, "wb")
+        return zstandard.ZstdCompressor(level=6, threads=-1).stream_writer(fh, closefd=True)
+
+    return open(path, "wb", buffering=1 << 20)
+
+
+def shard_of(doc_id, shards: int) -> int:
+    # ObjectId -> int: младшие байты (счётчик) распределены равномерно
+    return int(str(doc_id), 16) % shards if shards > 1 else 0
+
+
+def export(collection, query: dict, out: str, shards: int, compress: str, batch_size: int) -> dict:
+    paths = shard_paths(out, shards, compress)
+    files = [open_shard(p, compress) for p in paths]
+    buffers = [[] for _ in paths]
+
+    count = 0
+    raw_bytes = 0
+    start = time.perf_counter()
+
+    def flush(i):
+        nonlocal raw_bytes
+        with metrics.timer("export", compress=compress):
+            data = "".join(buffers[i]).encode("utf-8")
+            files[i].write(data)
+        raw_bytes += len(data)
+        metrics.inc("export_docs", len(buffers[i]))
+        metrics.inc("export_bytes", len(data))
+        buffers[i].clear()
+
+    try:
+        cursor = collection.find(query, {"title": 1, "summary": 1, "text": 1}, batch_size=batch_size)
+
+        for doc in cursor:
+            i = shard_of(doc["_id"], shards)
+            buffers[i].append(format_line(doc))
+            if len(buffers[i]) >= batch_size:
+                flush(i)
+
+            count += 1
+            if count % 1000 == 0:
+                print("Exported:", count)
+
+        for i in range(len(files)):
+            flush(i)
+    finally:
+        for f in files:
+            f.close()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "count": count,
+        "paths": paths,
+        "raw_bytes": raw_bytes,
+        "file_bytes": sum(os.path.getsize(p) for p in paths),
+        "seconds": elapsed,
+    }
+
+
+def report(stats: dict):
+    mb = stats["raw_bytes"] / (1 << 20)
+    seconds = max(stats["seconds"], 1e-9)
+
+    print("Done. Total documents:", stats["count"])
+    print(f"Text: {mb:.1f} MB in {seconds:.1f} s, {mb / seconds:.1f} MB/s")
+    print(f"On disk: {stats['file_bytes'] / (1 << 20):.1f} MB in {len(stats['paths'])} file(s)")
+    for path in stats["paths"]:
+        print("   ", path)
+
+
+# Инкрементальный режим: после каждой выгрузки запоминаем водяной знак
+# (время начала выгрузки) и список выгруженных id. Следующий запуск
+# с --incremental выгружает только документы с updated_at >= водяного знака
+# и список удалённых с прошлого раза id (tombstones).
+
+def state_paths(out: str) -> tuple[str, str]:
+    base, _ = os.path.splitext(out)
+    return base + ".state.json", base + ".ids"
+
+
+def load_state(out: str) -> tuple[dict | None, set]:
+    state_path, ids_path = state_paths(out)
+    if not os.path.exists(state_path) or not os.path.exists(ids_path):
+        return None, set()
+
+    with open(state_path, encoding="utf-8") as f:
+        state = json.load(f)
+    with open(ids_path, encoding="utf-8") as f:
+        ids = {line.strip() for line in f if line.strip()}
+    return state, ids
+
+
+def save_state(out: str, watermark: int, ids: set):
+    state_path, ids_path = state_paths(out)
+
+    with open(ids_path, "w", encoding="utf-8") as f:
+        f.writelines(f"{i}\n" for i in sorted(ids))
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump({"watermark": watermark, "count": len(ids)}, f)
+
+
+def server_watermark(collection) -> int:
+    # время сервера, а не этой машины: с ним сравниваются updated_at
+    now = collection.database.command("hello")["localTime"]
+    return timegm(now.utctimetuple()) - WATERMARK_SLACK
+
+
+def changed_since(watermark: int) -> dict:
+    # updated_at - Date, его ставит сервер ($currentDate в my_parser.py)
+    return {"updated_at": {"$gte": datetime.fromtimestamp(watermark, timezone.utc)}}
+
+
+def current_ids(collection) -> set:
+    return {str(doc["_id"]) for doc in collection.find({}, {"_id": 1}, batch_size=10000)}
+
+
+def export_incremental(collection, out: str, shards: int, compress: str, batch_size: int):
+    state, old_ids = load_state(out)
+    watermark = server_watermark(collection)
+
+    if state is None:
+        print("No previous export state, doing a full export")
+        stats = export(collection, {}, out, shards, compress, batch_size)
+        report(stats)
+        save_state(out, watermark, current_ids(collection))
+        return
+
+    collection.create_index("updated_at")
+
+    base, ext = os.path.splitext(out)
+    delta_out = f"{base}.delta.{watermark}{ext}"
+    tombstones_path = f"{base}.tombstones.{watermark}.txt"
+
+    print(f"Exporting changes since {state['watermark']}")
+    stats = export(collection, changed_since(state["watermark"]), delta_out, shards, compress, batch_size)
+    report(stats)
+
+    ids = current_ids(collection)
+    removed = sorted(old_ids - ids)
+    with open(tombstones_path, "w", encoding="utf-8") as f:
+        f.writelines(f"{i}\n" for i in removed)
+
+    print(f"Tombstones: {len(removed)} -> {tombstones_path}")
+    save_state(out, watermark, ids)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default="corpus.tsv")
+    ap.add_argument("--shards", type=int, default=1)
+    ap.add_argument("--compress", choices=sorted(SUFFIX), default="none")
+    ap.add_argument("--batch-size", type=int, default=2000)
+    ap.add_argument("--incremental", action="store_true",
+                    help="только изменённые с прошлой выгрузки документы + tombstones")
+    ap.add_argument("--metrics", help="файл метрик: *.json или формат Prometheus")
+    args = ap.parse_args()
+
+    metrics.start(args.metrics)
+    client = MongoClient("mongodb://localhost:27017", event_listeners=[metrics.CommandTimer()])
+    collection = client["ir_corpus"]["docs"]
+
+    try:
+        if args.incremental:
+            export_incremental(collection, args.out, args.shards, args.compress, args.batch_size)
+            return
+
+        watermark = server_watermark(collection)
+        stats = export(collection, {}, args.out, args.shards, args.compress, args.batch_size)
+        report(stats)
+        save_state(args.out, watermark, current_ids(collection))
+    finally:
+        metrics.stop()
+        metrics.report()
 
-    if count % 1000 == 0:
-        print("Exported:", count)
 
-out.close()
-print("Done. Total documents:", count)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import aiohttp
+
+import metrics
+
+
+@dataclass
+class Response:
+    url: str
+    status: int
+    text: str
+    headers: dict
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class TokenBucket:
+    # rate - токенов в секунду, capacity - допустимый "всплеск" запросов
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        waited = 0.0
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+
+                pause = (1 - self.tokens) / self.rate
+                waited += pause
+                await asyncio.sleep(pause)
+
+
+class Fetcher:
+    def __init__(self, cfg):
+        logic = cfg.get("logic", {})
+
+        # delay - пауза между запросами к хосту для всех воркеров вместе:
+        # у каждого из workers процессов свой token-bucket, поэтому каждый
+        # ждёт delay * workers
+        delay = logic.get("delay", 0.8) * max(cfg.get("worker", {}).get("count", 1), 1)
+        self.rate = 1.0 / delay if delay > 0 else float("inf")
+        self.burst = logic.get("burst", 1)
+        self.concurrency = logic.get("concurrency", 8)
+        self.timeout = logic.get("timeout", 10)
+        self.headers = {"User-Agent": logic.get("user_agent", "IR-Crawler")}
+
+        self.session: aiohttp.ClientSession | None = None
+        self.buckets: dict[str, TokenBucket] = {}
+        self.limits: dict[str, asyncio.Semaphore] = {}
+
+        self.started = time.monotonic()
+        self.pages = defaultdict(int)
+        self.requests = defaultdict(int)
+        self.waited = defaultdict(float)
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency * 4,
+            limit_per_host=self.concurrency,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _host_slot(self, host: str):
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+            self.limits[host] = asyncio.Semaphore(self.concurrency)
+        return self.buckets[host], self.limits[host]
+
+    async def get(
+        self,
+        url: str,
+        *,
+        params: dict | None = None,
+        headers: dict | None = None,
+        verify: bool = True,
+        encoding: str | None = None,
+    ) -> Response | None:
+        host = urlparse(url).netloc
+        bucket, limit = self._host_slot(host)
+
+        async with limit:
+            waited = await bucket.acquire()
+            self.waited[host] += waited
+            self.requests[host] += 1
+            metrics.observe("politeness_seconds", waited, host=host)
+
+            try:
+                with metrics.timer("fetch", host=host):
+                    async with self.session.get(
+                        url,
+                        params=params,
+                        headers=headers,
+                        ssl=None if verify else False,
+                    ) as r:
+                        if r.status == 200:
+                            text = await r.text(encoding=encoding, errors="replace")
+                            self.pages[host] += 1
+                        else:
+                            text = ""
+                        metrics.inc("http_responses", host=host, status=r.status)
+                        return Response(
+                            str(r.url), r.status, text, dict(r.headers),
+                            etag=r.headers.get("ETag"),
+                            last_modified=r.headers.get("Last-Modified"),
+                        )
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"[FETCH ERROR] {url}: {e!r}")
+                metrics.inc("http_errors", host=host)
+                return None
+
+    async def get_json(self, url: str, *, params: dict | None = None, headers: dict | None = None):
+        host = urlparse(url).netloc
+        bucket, limit = self._host_slot(host)
+
+        async with limit:
+            waited = await bucket.acquire()
+            self.waited[host] += waited
+            self.requests[host] += 1
+            metrics.observe("politeness_seconds", waited, host=host)
+
+            with metrics.timer("fetch", host=host):
+                async with self.session.get(url, params=params, headers=headers) as r:
+                    metrics.inc("http_responses", host=host, status=r.status)
+                    r.raise_for_status()
+                    return await r.json()
+
+    def report(self):
+        minutes = max(time.monotonic() - self.started, 1e-9) / 60
+
+        print("\n[THROUGHPUT]")
+        for host in sorted(self.requests):
+            print(
+                f"    {host}: {self.pages[host]} pages, {self.requests[host]} requests, "
+                f"{self.pages[host] / minutes:.1f} pages/min, "
+                f"waited {self.waited[host]:.1f}s on politeness"
+            )
+
+        total = sum(self.pages.values())
+        print(f"    total: {total} pages in {minutes:.1f} min, {total / minutes:.1f} pages/min")
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import socket
+import time
+
+from pymongo import ReturnDocument
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Frontier:
+    # Общая очередь задач обхода (коллекция queue) для нескольких процессов.
+    # Задача берётся в аренду: owner - id воркера, lease_until - срок аренды,
+    # heartbeat_at - последнее продление. Пока воркер жив, keep_alive продлевает
+    # аренду; упавший воркер перестаёт продлевать, и после lease_until задачу
+    # забирает любой другой. Все записи по задаче идут с условием owner, так что
+    # воркер, потерявший аренду, чужой прогресс не перетрёт.
+    def __init__(self, queue, worker_id=None, lease_seconds=300):
+        self.queue = queue
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+
+    @staticmethod
+    def expired(now) -> dict:
+        # задачи старой версии без lease_until тоже считаются брошенными
+        return {
+            "status": "processing",
+            "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}],
+        }
+
+    def create_indexes(self):
+        # под выборку в claim: источник, статус, затем приоритет
+        self.queue.create_index([("source", 1), ("status", 1), ("depth", 1), ("last_crawled", 1)])
+        self.queue.create_index([("status", 1), ("lease_until", 1)])
+
+    def claim(self, source: str):
+        # сначала мелкие (depth), среди них - давно не обходившиеся:
+        # у новых задач last_crawled нет, и null сортируется раньше чисел
+        now = int(time.time())
+        return self.queue.find_one_and_update(
+            {"source": source, "$or": [{"status": "pending"}, self.expired(now)]},
+            {
+                "$set": {
+                    "status": "processing",
+                    "owner": self.worker_id,
+                    "lease_until": now + self.lease_seconds,
+                    "heartbeat_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("depth", 1), ("last_crawled", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def owned(self, task) -> dict:
+        return {"_id": task["_id"], "owner": self.worker_id}
+
+    def heartbeat(self, task) -> bool:
+        # False - аренду уже забрал другой воркер
+        now = int(time.time())
+        r = self.queue.update_one(
+            self.owned(task),
+            {"$set": {"lease_until": now + self.lease_seconds, "heartbeat_at": now}}
+        )
+        return r.matched_count > 0
+
+    async def keep_alive(self, task):
+        # завершается только при потере аренды; обычно её отменяет вызывающий
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self.heartbeat(task):
+                print(f"[FRONTIER] lease lost: {task.get('title')}")
+                return
+
+    def finish(self, task, status: str, fields: dict | None = None) -> bool:
+        r = self.queue.update_one(
+            self.owned(task),
+            {
+                "$set": {"status": status, **(fields or {})},
+                "$unset": {"owner": "", "lease_until": "", "heartbeat_at": ""},
+            }
+        )
+        return r.matched_count > 0
+
+    def complete(self, task, fields: dict | None = None) -> bool:
+        return self.finish(task, "done", {"last_crawled": int(time.time()), "attempts": 0, **(fields or {})})
+
+    def release(self, task, fields: dict | None = None) -> bool:
+        return self.finish(task, "pending", fields)
+
+    def reclaim(self, source: str | None = None) -> int:
+        # просроченные аренды обратно в pending; задачи живых воркеров не трогаем
+        flt = self.expired(int(time.time()))
+        if source:
+            flt["source"] = source
+        r = self.queue.update_many(
+            flt,
+            {
+                "$set": {"status": "pending"},
+                "$unset": {"owner": "", "lease_until": "", "heartbeat_at": ""},
+            }
+        )
+        return r.modified_count
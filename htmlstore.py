@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import time
+
+from pymongo import MongoClient, UpdateOne
+
+import metrics
+from bulk_writer import BulkWriter
+
+# Сырой html хранится не в pages, а в отдельной коллекции blobs:
+# сжатый zstd и с ключом content_hash, так что одинаковые тела (зеркала,
+# повторные обходы) лежат один раз. Страницы одного источника - один и тот же
+# шаблон, поэтому для каждого источника обучается свой словарь zstd: на
+# securitylab он выносит в себя почти всю вёрстку.
+#
+# Словари лежат в blob_dicts под своим dict_id; у блоба записан dict_id,
+# которым он сжат, так что после переобучения старые блобы читаются
+# прежними словарями. dict 0 - сжатие без словаря.
+#
+# Для парсеров всё прозрачно: fill дописывает html в документы pages,
+# у которых его нет (страницы старого формата хранят html как раньше).
+
+BLOBS_COLLECTION = "blobs"
+DICTS_COLLECTION = "blob_dicts"
+
+ZSTD_LEVEL = 9
+DICT_SIZE = 110 << 10
+DICT_SAMPLES = 2000
+
+# блобы моложе этого не удаляются gc: страница могла ещё не записаться
+GC_GRACE = 3600
+
+RAW_FIELDS = {"url": 1, "html": 1, "source": 1, "content_hash": 1}
+
+
+def content_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8", errors="ignore")).hexdigest()
+
+
+class HtmlStore:
+    def __init__(self, db, level: int = ZSTD_LEVEL, writer: BulkWriter | None = None):
+        import zstandard
+
+        self.zstd = zstandard
+        self.level = level
+        self.blobs = db[BLOBS_COLLECTION]
+        self.dicts = db[DICTS_COLLECTION]
+        # запись блобов - через буфер; pages должен зависеть от него,
+        # чтобы страница не появлялась раньше своего html
+        self.writer = writer or BulkWriter(self.blobs)
+
+        self.compressors = {}
+        self.decompressors = {0: zstandard.ZstdDecompressor()}
+        self.plain = zstandard.ZstdCompressor(level=level)
+        self.load_dicts()
+
+    def load_dicts(self):
+        # последний обученный словарь источника - для сжатия, все - для чтения
+        for d in self.dicts.find({}).sort("trained_at", 1):
+            data = self.zstd.ZstdCompressionDict(d["data"])
+            self.decompressors[d["_id"]] = self.zstd.ZstdDecompressor(dict_data=data)
+            self.compressors[d["source"]] = (d["_id"], self.zstd.ZstdCompressor(level=self.level, dict_data=data))
+
+    def compress(self, source: str, raw: bytes) -> tuple[int, bytes]:
+        dict_id, cctx = self.compressors.get(source, (0, self.plain))
+        return dict_id, cctx.compress(raw)
+
+    def decompress(self, blob: dict) -> str:
+        return self.decompressors[blob["dict"]].decompress(blob["data"]).decode("utf-8", errors="replace")
+
+    def put(self, source: str, digest: str, html: str):
+        # $setOnInsert: тело с тем же хэшем уже лежит - повторно не пишем
+        raw = html.encode("utf-8", errors="replace")
+        with metrics.timer("compress", source=source):
+            dict_id, data = self.compress(source, raw)
+        self.writer.add(
+            UpdateOne(
+                {"_id": digest},
+                {"$setOnInsert": {
+                    "source": source,
+                    "dict": dict_id,
+                    "data": data,
+                    "size": len(raw),
+                    "stored": len(data),
+                    "created_at": int(time.time()),
+                }},
+                upsert=True
+            ),
+            key=digest
+        )
+
+    def load(self, digests) -> dict:
+        digests = list(set(digests))
+        if not digests:
+            return {}
+        return {b["_id"]: self.decompress(b) for b in self.blobs.find({"_id": {"$in": digests}})}
+
+    def fill(self, docs: list) -> list:
+        # html из blobs для документов pages нового формата
+        missing = [d["content_hash"] for d in docs if not d.get("html") and d.get("content_hash")]
+        if missing:
+            with metrics.timer("load_html"):
+                htmls = self.load(missing)
+            for d in docs:
+                if not d.get("html") and d.get("content_hash") in htmls:
+                    d["html"] = htmls[d["content_hash"]]
+        return docs
+
+    def flush(self):
+        self.writer.flush()
+
+    def train(self, pages, source: str, samples: int = DICT_SAMPLES, dict_size: int = DICT_SIZE) -> int | None:
+        docs = list(pages.aggregate([
+            {"$match": {"source": source}},
+            {"$sample": {"size": samples}},
+            {"$project": RAW_FIELDS},
+        ]))
+        data = [d["html"].encode("utf-8", errors="replace") for d in self.fill(docs) if d.get("html")]
+        if len(data) < 10:
+            print(f"[TRAIN] {source}: only {len(data)} samples, skipped")
+            return None
+
+        try:
+            trained = self.zstd.train_dictionary(dict_size, data)
+        except self.zstd.ZstdError as e:
+            print(f"[TRAIN] {source}: {e}")
+            return None
+
+        dict_id = trained.dict_id()
+        self.dicts.replace_one(
+            {"_id": dict_id},
+            {"_id": dict_id, "source": source, "data": trained.as_bytes(),
+             "samples": len(data), "trained_at": time.time()},
+            upsert=True
+        )
+        self.load_dicts()
+        print(f"[TRAIN] {source}: dict {dict_id}, {len(trained.as_bytes()) >> 10} KB from {len(data)} pages")
+        return dict_id
+
+
+def storage_stats(db) -> dict:
+    stats = {}
+    for name in ("pages", BLOBS_COLLECTION):
+        s = db.command("collStats", name)
+        stats[name] = {"count": s.get("count", 0), "size": s.get("size", 0), "storage": s.get("storageSize", 0)}
+
+    stats["sources"] = {
+        row["_id"]: row
+        for row in db[BLOBS_COLLECTION].aggregate([
+            {"$group": {"_id": "$source", "blobs": {"$sum": 1}, "size": {"$sum": "$size"}, "stored": {"$sum": "$stored"}}}
+        ])
+    }
+    stats["inline"] = db["pages"].count_documents({"html": {"$exists": True}})
+    return stats
+
+
+def scan_throughput(pages, store: HtmlStore, limit: int | None = None, batch_size: int = 500) -> dict:
+    # то же чтение, что в my_parser: документы пачками + html из blobs
+    docs = 0
+    chars = 0
+    start = time.perf_counter()
+
+    cursor = pages.find({}, RAW_FIELDS, batch_size=batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            docs += len(batch)
+            chars += sum(len(d.get("html") or "") for d in store.fill(batch))
+            batch = []
+    docs += len(batch)
+    chars += sum(len(d.get("html") or "") for d in store.fill(batch))
+
+    seconds = max(time.perf_counter() - start, 1e-9)
+    return {"docs": docs, "chars": chars, "seconds": seconds}
+
+
+def report(db, store: HtmlStore, limit: int | None = None):
+    stats = storage_stats(db)
+    mb = 1 << 20
+
+    print("\n[STORAGE]")
+    for name in ("pages", BLOBS_COLLECTION):
+        s = stats[name]
+        print(f"    {name}: {s['count']} docs, data {s['size'] / mb:.1f} MB, on disk {s['storage'] / mb:.1f} MB")
+    print(f"    pages with inline html: {stats['inline']}")
+
+    for source, s in sorted(stats["sources"].items()):
+        ratio = s["size"] / max(s["stored"], 1)
+        print(f"    {source}: {s['blobs']} blobs, {s['size'] / mb:.1f} MB -> {s['stored'] / mb:.1f} MB (x{ratio:.1f})")
+
+    scan = scan_throughput(db["pages"], store, limit)
+    print("\n[SCAN]")
+    print(f"    {scan['docs']} docs, {scan['chars'] / mb:.1f} M chars of html in {scan['seconds']:.1f} s")
+    print(f"    {scan['docs'] / scan['seconds']:.0f} docs/s, {scan['chars'] / mb / scan['seconds']:.1f} M chars/s")
+
+
+def migrate(db, store: HtmlStore, batch_size: int = 500, train: bool = True) -> int:
+    pages_coll = db["pages"]
+
+    if train:
+        for source in pages_coll.distinct("source"):
+            if source not in store.compressors:
+                store.train(pages_coll, source)
+
+    # страница теряет html только после записи блоба
+    pages = BulkWriter(pages_coll, batch_size, depends_on=store.writer)
+    moved = 0
+
+    cursor = pages_coll.find({"html": {"$exists": True}}, RAW_FIELDS, batch_size=batch_size).sort("_id", 1)
+    for doc in cursor:
+        html = doc.get("html") or ""
+        digest = doc.get("content_hash") or content_hash(html)
+
+        store.put(doc.get("source"), digest, html)
+        pages.add(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"content_hash": digest}, "$unset": {"html": ""}}
+        ))
+
+        moved += 1
+        if moved % 10000 == 0:
+            print(f"    migrated {moved}")
+
+    pages.flush()
+    return moved
+
+
+def gc(db) -> int:
+    # блобы, на которые больше не ссылается ни одна страница
+    referenced = set(db["pages"].distinct("content_hash"))
+    threshold = int(time.time()) - GC_GRACE
+
+    orphans = [
+        b["_id"]
+        for b in db[BLOBS_COLLECTION].find({"created_at": {"$lt": threshold}}, {"_id": 1})
+        if b["_id"] not in referenced
+    ]
+    for i in range(0, len(orphans), 1000):
+        db[BLOBS_COLLECTION].delete_many({"_id": {"$in": orphans[i:i + 1000]}})
+    return len(orphans)
+
+
+def main():
+    # python htmlstore.py report|train|migrate|gc
+    ap = argparse.ArgumentParser()
+    ap.add_argument("command", choices=["report", "train", "migrate", "gc"])
+    ap.add_argument("--uri", default="mongodb://localhost:27017")
+    ap.add_argument("--db", default="ir_crawler")
+    ap.add_argument("--level", type=int, default=ZSTD_LEVEL)
+    ap.add_argument("--source", action="append", help="для train; по умолчанию все источники")
+    ap.add_argument("--samples", type=int, default=DICT_SAMPLES)
+    ap.add_argument("--scan-limit", type=int, help="сколько страниц читать при замере скорости")
+    ap.add_argument("--no-train", action="store_true", help="migrate без обучения словарей")
+    ap.add_argument("--compact", action="store_true", help="после migrate вернуть место pages на диск")
+    args = ap.parse_args()
+
+    db = MongoClient(args.uri)[args.db]
+    store = HtmlStore(db, args.level)
+
+    if args.command == "report":
+        report(db, store, args.scan_limit)
+
+    elif args.command == "train":
+        for source in args.source or db["pages"].distinct("source"):
+            store.train(db["pages"], source, args.samples)
+
+    elif args.command == "migrate":
+        print("=== before ===")
+        report(db, store, args.scan_limit)
+
+        start = time.perf_counter()
+        moved = migrate(db, store, train=not args.no_train)
+        print(f"\nMigrated {moved} pages in {time.perf_counter() - start:.1f} s")
+
+        if args.compact:
+            db.command("compact", "pages")
+
+        print("\n=== after ===")
+        report(db, store, args.scan_limit)
+
+    elif args.command == "gc":
+        print(f"Removed {gc(db)} orphan blobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Инвертированный индекс по corpus.tsv (выход export.py).
+# Токенизация и стемминг - те же правила, что в main_linux.cpp.
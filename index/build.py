@@ -0,0 +1,506 @@
+import argparse
+import gzip
+import heapq
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from index.codec import decode_postings, decode_values, encode_postings, encode_values, read_varint, write_varint
+from index.rank import B, K1, doc_norms, idf, term_upper_bound
+from index.tokenizer import OPERATORS, stem_cache_stats, tokenize_and_stem, warm_stem_cache
+
+# python -m index.build corpus.tsv --out index_data --workers 8
+#
+# Формат каталога индекса:
+#   docs.tsv      - i-я строка = ObjectId документа с плотным id i \t длина в токенах
+#   postings.bin  - списки doc id подряд, delta + varint (index/codec.py)
+#   tfs.bin       - параллельно postings.bin: tf для каждой записи, varint
+#   positions.bin - только с --positions: для каждой записи varint длина блока
+#                   и позиции терма в документе, delta + varint; длина блока
+#                   позволяет перешагнуть позиции ненужных документов
+#   terms.tsv     - терм \t df \t смещение и длина в postings.bin
+#                   \t смещение и длина в tfs.bin \t верхняя граница BM25
+#                   \t смещение и длина в positions.bin
+#   meta.json     - счётчики и параметры сборки; generation растёт с каждой
+#                   пересборкой - по нему поиск сбрасывает кэш
+#
+# Каждая сборка - отдельный каталог gen-<built_at> с этими файлами. Какой из
+# них текущий, записано в файле CURRENT (имя каталога); он пишется через
+# временный файл и os.replace, так что читатель видит либо старое поколение,
+# либо новое целиком. Файлы открытого индекса не подменяются и не удаляются
+# до переключения: на Windows os.replace и удаление отображённого через mmap
+# файла падают. Старые gen-* удаляются после переключения; те, что ещё
+# открыты, остаются до следующей сборки.
+#
+# Сборка SPIMI: corpus.tsv режется на диапазоны байт по границам строк,
+# каждый воркер строит свой частичный индекс и, как только в памяти набралось
+# run_postings записей, сбрасывает его отсортированным по термам файлом-прогоном.
+# Затем все прогоны сливаются k-way merge в итоговый индекс. Плотный doc id =
+# база диапазона + локальный номер документа в нём, поэтому порядок документов
+# тот же, что при последовательном чтении корпуса.
+
+FORMAT_VERSION = 3
+
+DOCS_FILE = "docs.tsv"
+POSTINGS_FILE = "postings.bin"
+TFS_FILE = "tfs.bin"
+POSITIONS_FILE = "positions.bin"
+TERMS_FILE = "terms.tsv"
+META_FILE = "meta.json"
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+COMPRESSED = (".gz", ".zst")
+
+
+def open_corpus(path: str):
+    # newline="\n": в тексте могут остаться \r, строку режем только по \n, как getline
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="\n")
+
+    if path.endswith(".zst"):
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="\n")
+
+    return open(path, encoding="utf-8", newline="\n")
+
+
+def prefix_end(path: str, limit: int) -> tuple[int, int | None]:
+    # сколько строк из limit есть в файле и где кончается последняя из них
+    if path.endswith(COMPRESSED):
+        with open_corpus(path) as f:
+            return sum(1 for _ in zip(range(limit), f)), None
+
+    taken = 0
+    with open(path, "rb") as f:
+        while taken < limit and f.readline():
+            taken += 1
+        return taken, f.tell()
+
+
+def line_boundary(f, pos: int) -> int:
+    # начало первой строки, которая начинается не раньше pos
+    if pos == 0:
+        return 0
+    f.seek(pos - 1)
+    f.readline()
+    return f.tell()
+
+
+def split_ranges(paths: list[str], workers: int, limit: int | None = None) -> list[tuple]:
+    # (path, start, end, limit): сжатые файлы не режутся - каждый целиком,
+    # несжатые - примерно на workers равных кусков
+    ranges = []
+    remaining = limit
+
+    for path in paths:
+        if remaining is not None and remaining <= 0:
+            break
+
+        end = None
+        file_limit = None
+        if remaining is not None:
+            taken, end = prefix_end(path, remaining)
+            remaining -= taken
+            file_limit = taken
+
+        if path.endswith(COMPRESSED):
+            ranges.append((path, 0, None, file_limit))
+            continue
+
+        if end is None:
+            end = os.path.getsize(path)
+
+        with open(path, "rb") as f:
+            bounds = sorted({line_boundary(f, end * i // workers) for i in range(workers)} | {end})
+        bounds = [b for b in bounds if b <= end]
+
+        ranges.extend((path, lo, hi, None) for lo, hi in zip(bounds, bounds[1:]) if lo < hi)
+
+    return ranges
+
+
+def read_range(path: str, start: int, end: int | None, limit: int | None):
+    # (doc_id, text, байт в строке) для строк, начинающихся в [start, end)
+    if end is None:
+        with open_corpus(path) as f:
+            for n, line in enumerate(f):
+                if limit is not None and n >= limit:
+                    return
+                doc_id, tab, text = line.rstrip("\n").partition("\t")
+                if tab:
+                    yield doc_id, text, len(line.encode("utf-8"))
+        return
+
+    with open(path, "rb", buffering=1 << 20) as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                return
+            pos += len(line)
+
+            doc_id, tab, text = line.decode("utf-8").rstrip("\n").partition("\t")
+            if tab:
+                yield doc_id, text, len(line)
+
+
+def write_run(path: str, postings: dict[str, tuple[array, array, bytearray]]):
+    # прогон: по термам [терм, doc id, tf, блоки позиций], перед каждым - varint длина
+    buf = bytearray()
+    with open(path, "wb") as f:
+        for term in sorted(postings):
+            ids, tfs, positions = postings[term]
+            key = term.encode("utf-8")
+            for chunk in (key, encode_postings(ids), encode_values(tfs), positions):
+                write_varint(buf, len(chunk))
+                buf += chunk
+
+            if len(buf) >= 1 << 20:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
+
+
+def read_run(path: str, seq: int, base: int):
+    with open(path, "rb", buffering=1 << 20) as f:
+        while (n := read_varint(f)) is not None:
+            term = f.read(n).decode("utf-8")
+            ids = f.read(read_varint(f))
+            tfs = f.read(read_varint(f))
+            positions = f.read(read_varint(f))
+            yield term, seq, base, ids, tfs, positions
+
+
+def index_range(task: tuple) -> dict:
+    # воркер: частичный индекс по одному диапазону корпуса
+    part, (path, start, end, limit), tmp_dir, run_postings, with_positions = task
+
+    postings: dict[str, tuple[array, array, bytearray]] = {}
+    stem_before = stem_cache_stats()
+    in_memory = 0
+    runs = []
+    count = 0
+    corpus_bytes = 0
+
+    def flush():
+        nonlocal in_memory
+        if postings:
+            run = os.path.join(tmp_dir, f"run.{part:04d}.{len(runs):04d}.bin")
+            write_run(run, postings)
+            runs.append(run)
+            postings.clear()
+            in_memory = 0
+
+    docs_path = os.path.join(tmp_dir, f"docs.{part:04d}.tsv")
+    with open(docs_path, "w", encoding="utf-8", newline="\n") as docs:
+        for doc_id, text, size in read_range(path, start, end, limit):
+            local_id = count
+            count += 1
+            corpus_bytes += size
+
+            # and/or/not - операторы запроса, найти их как термы нельзя;
+            # позиции считаются уже без них, как и в разобранном запросе
+            tokens = [t for t in tokenize_and_stem(text) if t not in OPERATORS]
+            docs.write(f"{doc_id}\t{len(tokens)}\n")
+
+            where = {}
+            if with_positions:
+                for i, t in enumerate(tokens):
+                    where.setdefault(t, []).append(i)
+                tf = {t: len(p) for t, p in where.items()}
+            else:
+                tf = Counter(tokens)
+
+            for term, n in tf.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = (array("I"), array("I"), bytearray())
+                entry[0].append(local_id)
+                entry[1].append(n)
+                in_memory += 1
+
+                if with_positions:
+                    block = encode_postings(where[term])
+                    write_varint(entry[2], len(block))
+                    entry[2].extend(block)
+                    in_memory += n
+
+            if in_memory >= run_postings:
+                flush()
+
+    flush()
+    stem_after = stem_cache_stats()
+    return {
+        "count": count,
+        "corpus_bytes": corpus_bytes,
+        "runs": runs,
+        "docs": docs_path,
+        "stem_hits": stem_after["hits"] - stem_before["hits"],
+        "stem_misses": stem_after["misses"] - stem_before["misses"],
+    }
+
+
+def merge_runs(parts: list[dict], out_dir: str, norms: list[float], with_positions: bool) -> tuple[int, int]:
+    # k-way merge прогонов по (терм, номер прогона); внутри терма прогоны
+    # идут в порядке документов, так что списки просто склеиваются со сдвигом
+    streams = []
+    base = 0
+    for part in parts:
+        for run in part["runs"]:
+            streams.append(read_run(run, len(streams), base))
+        base += part["count"]
+
+    n_docs = len(norms)
+    terms = 0
+    total = 0
+    offset = 0
+    tf_offset = 0
+    pos_offset = 0
+    merged = heapq.merge(*streams, key=lambda r: (r[0], r[1]))
+
+    pos_path = os.path.join(out_dir, POSITIONS_FILE)
+
+    with open(os.path.join(out_dir, POSTINGS_FILE), "wb", buffering=1 << 20) as pf, \
+            open(os.path.join(out_dir, TFS_FILE), "wb", buffering=1 << 20) as ff, \
+            open(pos_path if with_positions else os.devnull, "wb", buffering=1 << 20) as qf, \
+            open(os.path.join(out_dir, TERMS_FILE), "w", encoding="utf-8", newline="\n") as out:
+        for term, group in groupby(merged, key=lambda r: r[0]):
+            ids = array("I")
+            tfs = array("I")
+            positions = bytearray()
+            for _, _, shift, chunk, tf_chunk, pos_chunk in group:
+                local = decode_postings(chunk)
+                if shift:
+                    ids.extend(x + shift for x in local)
+                else:
+                    ids.extend(local)
+                tfs.extend(decode_values(tf_chunk))
+                # позиции относятся к документу, сдвиг doc id их не касается
+                positions += pos_chunk
+
+            data = encode_postings(ids)
+            tf_data = encode_values(tfs)
+            # граница уже округлена вверх; repr пишет её без потерь - MaxScore
+            # считает её точной, и заниженная отсекла бы документ на пороге
+            bound = term_upper_bound(idf(len(ids), n_docs), ids, tfs, norms)
+
+            pf.write(data)
+            ff.write(tf_data)
+            qf.write(positions)
+            out.write(
+                f"{term}\t{len(ids)}\t{offset}\t{len(data)}\t{tf_offset}\t{len(tf_data)}\t{bound!r}"
+                f"\t{pos_offset}\t{len(positions)}\n"
+            )
+            offset += len(data)
+            tf_offset += len(tf_data)
+            pos_offset += len(positions)
+            terms += 1
+            total += len(ids)
+
+    return terms, total
+
+
+def index_dir(out_dir: str) -> str:
+    # каталог текущего поколения
+    with open(os.path.join(out_dir, CURRENT_FILE), encoding="utf-8") as f:
+        return os.path.join(out_dir, f.read().strip())
+
+
+def index_size(path: str) -> dict:
+    # path - каталог поколения
+    return {
+        name: os.path.getsize(os.path.join(path, name))
+        for name in (DOCS_FILE, POSTINGS_FILE, TFS_FILE, POSITIONS_FILE, TERMS_FILE, META_FILE)
+        if os.path.exists(os.path.join(path, name))
+    }
+
+
+def current_generation(out_dir: str) -> int:
+    try:
+        with open(os.path.join(index_dir(out_dir), META_FILE), encoding="utf-8") as f:
+            return json.load(f).get("generation", 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def publish(out_dir: str, stage_dir: str, built_at: int) -> str:
+    # stage_dir становится новым gen-*, CURRENT переключается на него
+    while True:
+        name = f"{GENERATION_PREFIX}{built_at}"
+        if not os.path.exists(os.path.join(out_dir, name)):
+            break
+        built_at += 1
+    os.replace(stage_dir, os.path.join(out_dir, name))
+
+    tmp = os.path.join(out_dir, f"{CURRENT_FILE}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name)
+    os.replace(tmp, os.path.join(out_dir, CURRENT_FILE))
+    return name
+
+
+def remove_stale(out_dir: str, current: str):
+    # прежние поколения; открытые другим процессом на Windows не удалятся -
+    # их уберёт следующая сборка
+    for name in os.listdir(out_dir):
+        if name.startswith(GENERATION_PREFIX) and name != current:
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+
+def build(paths: list[str], out_dir: str, workers: int = 1, run_postings: int = 2_000_000,
+          limit: int | None = None, positions: bool = False, warm_stems: str | None = None,
+          warm_top: int = 50000) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix="runs_", dir=out_dir)
+    stage_dir = os.path.join(tmp_dir, "index")
+    os.makedirs(stage_dir)
+
+    start = time.perf_counter()
+    try:
+        ranges = split_ranges(paths, workers, limit)
+        tasks = [(i, r, tmp_dir, run_postings, positions) for i, r in enumerate(ranges)]
+
+        # кэш стемминга прогревается в каждом процессе, где идёт токенизация
+        warm = (warm_stems, warm_top) if warm_stems else None
+        if workers <= 1:
+            if warm:
+                warm_stem_cache(*warm)
+            parts = [index_range(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=warm_stem_cache if warm else None,
+                                     initargs=warm or ()) as pool:
+                parts = []
+                for part in pool.map(index_range, tasks):
+                    parts.append(part)
+                    print(f"Range {len(parts)}/{len(tasks)}: {part['count']} docs, {len(part['runs'])} run(s)")
+        indexed = time.perf_counter()
+
+        doc_lens = array("I")
+        with open(os.path.join(stage_dir, DOCS_FILE), "wb") as out:
+            for part in parts:
+                with open(part["docs"], "rb") as f:
+                    doc_lens.extend(int(line.rsplit(b"\t", 1)[1]) for line in f)
+                    f.seek(0)
+                    shutil.copyfileobj(f, out)
+
+        avgdl = sum(doc_lens) / len(doc_lens) if doc_lens else 0.0
+        terms, total = merge_runs(parts, stage_dir, doc_norms(doc_lens, avgdl), positions)
+        done = time.perf_counter()
+
+        meta = {
+            "format": FORMAT_VERSION,
+            "generation": current_generation(out_dir) + 1,
+            "sources": paths,
+            "docs": sum(p["count"] for p in parts),
+            "terms": terms,
+            "postings": total,
+            "corpus_bytes": sum(p["corpus_bytes"] for p in parts),
+            "avgdl": avgdl,
+            "k1": K1,
+            "b": B,
+            "positions": positions,
+            "workers": workers,
+            "ranges": len(parts),
+            "runs": sum(len(p["runs"]) for p in parts),
+            "stem_hits": sum(p["stem_hits"] for p in parts),
+            "stem_misses": sum(p["stem_misses"] for p in parts),
+            "built_at": int(time.time()),
+        }
+        with open(os.path.join(stage_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        current = publish(out_dir, stage_dir, meta["built_at"])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    remove_stale(out_dir, current)
+
+    return {
+        **meta,
+        "files": index_size(os.path.join(out_dir, current)),
+        "index_seconds": indexed - start,
+        "write_seconds": done - indexed,
+        "seconds": done - start,
+    }
+
+
+def report(stats: dict):
+    mb = stats["corpus_bytes"] / (1 << 20)
+    seconds = max(stats["seconds"], 1e-9)
+    size = sum(stats["files"].values())
+
+    print("Done. Documents:", stats["docs"])
+    print(f"Terms: {stats['terms']}, postings: {stats['postings']}")
+    print(f"Workers: {stats['workers']}, ranges: {stats['ranges']}, runs: {stats['runs']}")
+    stems = stats["stem_hits"] + stats["stem_misses"]
+    print(f"Stem cache: {stats['stem_hits']} hits of {stems}, hit rate {stats['stem_hits'] / max(stems, 1):.1%}")
+    print(
+        f"Corpus: {mb:.1f} MB in {seconds:.1f} s, {mb / seconds:.2f} MB/s "
+        f"(tokenize {stats['index_seconds']:.1f} s, merge {stats['write_seconds']:.1f} s)"
+    )
+    print(f"Index: {size / (1 << 20):.1f} MB, {size / max(stats['corpus_bytes'], 1):.1%} of corpus")
+    for name, n in stats["files"].items():
+        print(f"    {name}: {n / (1 << 20):.2f} MB")
+    if stats["postings"]:
+        print(f"Postings: {stats['files'][POSTINGS_FILE] / stats['postings']:.2f} bytes per entry")
+    if POSITIONS_FILE in stats["files"]:
+        extra = stats["files"][POSITIONS_FILE]
+        print(f"Positions overhead: {extra / (1 << 20):.2f} MB, +{extra / max(size - extra, 1):.1%} to the index")
+
+
+def bench(paths: list[str], limits: list[int], workers: int, run_postings: int, positions: bool = False,
+          warm_stems: str | None = None):
+    # время сборки и размер индекса в зависимости от размера корпуса
+    rows = []
+    for limit in limits:
+        out_dir = tempfile.mkdtemp(prefix="index_bench_")
+        try:
+            stats = build(paths, out_dir, workers, run_postings, limit, positions, warm_stems)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        rows.append(stats)
+
+    print(f"\n{'docs':>8} {'corpus MB':>10} {'index MB':>9} {'ratio':>7} {'terms':>9} {'sec':>7} {'MB/s':>6}")
+    for s in rows:
+        corpus = s["corpus_bytes"] / (1 << 20)
+        size = sum(s["files"].values()) / (1 << 20)
+        print(
+            f"{s['docs']:>8} {corpus:>10.1f} {size:>9.1f} {size / max(corpus, 1e-9):>7.1%} "
+            f"{s['terms']:>9} {s['seconds']:>7.1f} {corpus / max(s['seconds'], 1e-9):>6.2f}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("corpus", nargs="*", default=["corpus.tsv"], help="выход export.py, в т.ч. шарды и .gz/.zst")
+    ap.add_argument("--out", default="index_data")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--run-postings", type=int, default=2_000_000,
+                    help="сколько записей воркер держит в памяти до сброса прогона на диск")
+    ap.add_argument("--limit", type=int, default=None, help="взять только первые N документов")
+    ap.add_argument("--bench", default=None, help="через запятую: размеры корпуса в документах")
+    ap.add_argument("--positions", action="store_true", help="позиционный индекс для фраз и NEAR/k")
+    ap.add_argument("--warm-stems", default=None, help="form_freq.tsv (python -m index.tokenizer --dump-forms) для прогрева кэша стемминга")
+    ap.add_argument("--warm-top", type=int, default=50000)
+    args = ap.parse_args()
+
+    if args.bench:
+        bench(args.corpus, [int(x) for x in args.bench.split(",")], args.workers, args.run_postings, args.positions,
+              args.warm_stems)
+        return
+
+    report(build(args.corpus, args.out, args.workers, args.run_postings, args.limit, args.positions,
+                 args.warm_stems, args.warm_top))
+
+
+if __name__ == "__main__":
+    main()
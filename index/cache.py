@@ -0,0 +1,192 @@
+import copy
+import json
+import os
+import sys
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from index.build import META_FILE, index_dir
+from index.search import Index, intersect, parse_query, rank_terms
+from index.tokenizer import stem_cache_stats
+
+# Кэш результатов поверх Index.
+#
+# Ключ - нормализованный запрос после токенизации и стемминга, поэтому
+# "Атаки" и "атака" попадают в одну запись. Вытеснение LRU с двумя
+# ограничениями: по числу записей и по оценке занятой памяти. Отдельно
+# кэшируются пересечения частых пар термов из and-серий: пара попадает в кэш,
+# когда встретилась хотя бы pair_min_count раз. Когда CURRENT указывает на
+# новое поколение (пересборка индекса после нового экспорта), оно открывается
+# рядом со старым, и только после этого старые mmap закрываются, а кэш
+# сбрасывается.
+
+ENTRY_OVERHEAD = 200
+
+
+def result_size(value) -> int:
+    if isinstance(value, array):
+        return ENTRY_OVERHEAD + value.itemsize * len(value)
+    # ранжированный результат: ([(счёт, doc)], stats)
+    hits, _ = value
+    return ENTRY_OVERHEAD + 80 * len(hits)
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, kind: str = "query"):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses[kind] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits[kind] += 1
+        return entry[0]
+
+    def put(self, key, value, size: int | None = None):
+        size = result_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+
+        self.entries[key] = (value, size)
+        self.bytes += size
+
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        self.invalidations += 1
+
+    def metrics(self) -> dict:
+        out = {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+        for kind in sorted(set(self.hits) | set(self.misses)):
+            total = self.hits[kind] + self.misses[kind]
+            out[f"{kind}_hits"] = self.hits[kind]
+            out[f"{kind}_misses"] = self.misses[kind]
+            out[f"{kind}_hit_rate"] = self.hits[kind] / total if total else 0.0
+        return out
+
+
+class CachedIndex(Index):
+    def __init__(self, path: str, cache: QueryCache | None = None, check_every: float = 5.0,
+                 pair_min_count: int = 2):
+        super().__init__(path)
+        self.cache = cache or QueryCache()
+        self.check_every = check_every
+        self.pair_min_count = pair_min_count
+        self.pair_counts = Counter()
+        self._checked = time.monotonic()
+
+    @property
+    def generation(self) -> int:
+        return self.meta.get("generation", 0)
+
+    def refresh(self):
+        # не чаще раза в check_every секунд: читать CURRENT и meta.json на каждый запрос дорого
+        now = time.monotonic()
+        if now - self._checked < self.check_every:
+            return
+        self._checked = now
+
+        try:
+            path = index_dir(self.path)
+            with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+                generation = json.load(f).get("generation", 0)
+        except (OSError, ValueError):
+            return
+        if path == self.dir and generation == self.generation:
+            return
+
+        # новое поколение открывается, пока старое ещё отображено; не открылось
+        # (успели удалить или недописано) - работаем на старом до следующей проверки
+        try:
+            fresh = Index(self.path)
+        except (OSError, ValueError, KeyError):
+            return
+
+        print(f"Index generation {self.generation} -> {fresh.meta.get('generation', 0)}, reloading", file=sys.stderr)
+        old = copy.copy(self)
+        vars(self).update(vars(fresh))
+        old.close()
+        self.cache.clear()
+        self.pair_counts.clear()
+
+    def search(self, query: str) -> array:
+        self.refresh()
+        first, rest = parse_query(query)
+        key = ("query", first, tuple(rest))
+
+        result = self.cache.get(key)
+        if result is None:
+            result = self.evaluate(first, rest)
+            self.cache.put(key, result)
+        return result
+
+    def ranked(self, query: str, k: int = 10) -> tuple[list[tuple[float, int]], dict]:
+        self.refresh()
+        terms = rank_terms(query)
+        key = ("rank", k, tuple(sorted(terms)))
+
+        result = self.cache.get(key, "rank")
+        if result is None:
+            result = self.rank_terms(terms, k)
+            self.cache.put(key, result)
+        return result
+
+    def term_lists(self, terms: list[str]) -> list[array]:
+        # два самых редких терма серии пересекаем через кэш пар
+        terms = sorted(set(terms), key=self.df)
+        if len(terms) < 2:
+            return super().term_lists(terms)
+
+        a, b = terms[:2]
+        return [self.pair(a, b)] + [self.postings(t) for t in terms[2:]]
+
+    def pair(self, a: str, b: str) -> array:
+        key = ("pair", min(a, b), max(a, b))
+        result = self.cache.get(key, "pair")
+        if result is not None:
+            return result
+
+        result = intersect(self.postings(a), self.postings(b))
+
+        # счётчик пар тоже ограничен, иначе на длинном логе растёт без конца
+        if len(self.pair_counts) > self.cache.max_entries * 10:
+            self.pair_counts.clear()
+        self.pair_counts[key] += 1
+        if self.pair_counts[key] >= self.pair_min_count:
+            self.cache.put(key, result)
+        return result
+
+    def metrics(self) -> dict:
+        stems = stem_cache_stats()
+        return {
+            "generation": self.generation,
+            **self.cache.metrics(),
+            "stem_hit_rate": stems["hit_rate"],
+            "stem_cache_size": stems["size"],
+        }
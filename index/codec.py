@@ -0,0 +1,90 @@
+from array import array
+from itertools import accumulate
+
+# Списки словопозиций хранятся как разности соседних doc id в varint:
+# 7 бит на байт, старший бит - "будет ещё байт". Частоты термов (tf) -
+# просто varint подряд, без разностей.
+
+
+def encode_values(values) -> bytes:
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_values(buf, start: int = 0, end: int | None = None) -> array:
+    if end is None:
+        end = len(buf)
+
+    # частый случай: все значения < 128, каждый байт - готовое число
+    chunk = buf[start:end]
+    if not chunk or max(chunk) < 0x80:
+        return array("I", iter(chunk))
+
+    values = array("I")
+    value = 0
+    shift = 0
+
+    for b in chunk:
+        value |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+
+        values.append(value)
+        value = 0
+        shift = 0
+
+    return values
+
+
+def encode_postings(doc_ids) -> bytes:
+    prev = 0
+    gaps = []
+    for doc_id in doc_ids:
+        gaps.append(doc_id - prev)
+        prev = doc_id
+    return encode_values(gaps)
+
+
+def decode_postings(buf, start: int = 0, end: int | None = None) -> array:
+    return array("I", accumulate(decode_values(buf, start, end)))
+
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint_at(buf, pos: int) -> tuple[int, int]:
+    # (значение, позиция за ним) из буфера или mmap
+    value = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_varint(f) -> int | None:
+    # из файла побайтно; None - конец файла
+    value = 0
+    shift = 0
+    while True:
+        b = f.read(1)
+        if not b:
+            return None
+        b = b[0]
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value
+        shift += 7
@@ -0,0 +1,102 @@
+import heapq
+import math
+from bisect import bisect_left
+
+# Ранжирование BM25 с отсечением MaxScore.
+#
+# Для каждого терма при сборке считается верхняя граница его вклада в счёт
+# документа (max_score в terms.tsv). Термы запроса сортируются по этой
+# границе; младшие термы, сумма границ которых не больше порога top-k
+# (счёт k-го документа в куче), "необязательные": документ, встречающийся
+# только в них, в top-k не попадёт. Кандидаты берутся только из обязательных
+# списков, а необязательные проверяются точечно и лишь пока сумма оставшихся
+# границ ещё может поднять документ выше порога.
+
+K1 = 1.2
+B = 0.75
+
+
+def idf(df: int, n: int) -> float:
+    return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+
+def doc_norms(doc_lens, avgdl: float) -> list[float]:
+    # знаменатель BM25 без tf: k1 * (1 - b + b * dl / avgdl)
+    avgdl = avgdl or 1.0
+    return [K1 * (1 - B + B * dl / avgdl) for dl in doc_lens]
+
+
+def term_upper_bound(term_idf: float, ids, tfs, norms) -> float:
+    # та же формула и тот же порядок операций, что в top_k, иначе граница
+    # может разойтись со счётом в последнем бите
+    exact = max((term_idf * tf * (K1 + 1) / (tf + norms[d]) for d, tf in zip(ids, tfs)), default=0.0)
+    # округление вверх с запасом: суммы границ и счетов в top_k складываются
+    # в разном порядке и тоже расходятся на единицы ulp
+    return math.nextafter(math.ceil(exact * 1e6) / 1e6, math.inf)
+
+
+def top_k(lists: list[tuple], norms, k: int) -> tuple[list[tuple[float, int]], dict]:
+    # lists: [(idf, upper_bound, ids, tfs)]; -> [(счёт, doc id)] по убыванию
+    terms = sorted((t for t in lists if len(t[2])), key=lambda t: t[1])
+    m = len(terms)
+
+    # below[i] - сумма границ термов 0..i-1
+    below = [0.0]
+    for t in terms:
+        below.append(below[-1] + t[1])
+
+    pos = [0] * m
+    heap: list[tuple[float, int]] = []
+    theta = 0.0
+    essential = 0
+    scored = 0
+
+    while True:
+        while essential < m and below[essential + 1] <= theta:
+            essential += 1
+        if essential == m:
+            break
+
+        d = None
+        for i in range(essential, m):
+            ids = terms[i][2]
+            if pos[i] < len(ids) and (d is None or ids[pos[i]] < d):
+                d = ids[pos[i]]
+        if d is None:
+            break
+
+        score = 0.0
+        norm = norms[d]
+        for i in range(essential, m):
+            term_idf, _, ids, tfs = terms[i]
+            p = pos[i]
+            if p < len(ids) and ids[p] == d:
+                tf = tfs[p]
+                score += term_idf * tf * (K1 + 1) / (tf + norm)
+                pos[i] = p + 1
+                scored += 1
+
+        # необязательные - от старших к младшим, пока ещё можно обогнать порог
+        for i in range(essential - 1, -1, -1):
+            if score + below[i + 1] <= theta:
+                break
+
+            term_idf, _, ids, tfs = terms[i]
+            p = bisect_left(ids, d, pos[i])
+            pos[i] = p
+            if p < len(ids) and ids[p] == d:
+                tf = tfs[p]
+                score += term_idf * tf * (K1 + 1) / (tf + norm)
+                pos[i] = p + 1
+                scored += 1
+
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -d))
+        elif score > theta:
+            heapq.heapreplace(heap, (score, -d))
+        if len(heap) == k:
+            theta = heap[0][0]
+
+    total = sum(len(t[2]) for t in terms)
+    hits = [(score, -neg) for score, neg in sorted(heap, reverse=True)]
+    return hits, {"postings": total, "scored": scored, "skipped": total - scored}
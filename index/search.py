@@ -0,0 +1,517 @@
+import argparse
+import json
+import mmap
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+from index.build import DOCS_FILE, META_FILE, POSITIONS_FILE, POSTINGS_FILE, TERMS_FILE, TFS_FILE, index_dir
+from index.codec import decode_postings, decode_values, read_varint_at
+from index.rank import doc_norms, idf, top_k
+from index.tokenizer import OPERATORS, tokenize_and_stem
+
+# python -m index.search --index index_data информационный поиск
+# python -m index.search --index index_data --rank --top 10 информационный поиск
+# python -m index.search --index index_data '"атака нулевого дня" or эксплойт NEAR/3 ядро'
+# python -m index.search --index index_data --bench queries.txt [--rank]
+#
+# Синтаксис запроса как у boolean_search в main_linux.cpp: термы сворачиваются
+# слева направо, между соседними термами по умолчанию and, оператор действует
+# на следующий терм. Результат - отсортированные плотные doc id.
+#
+# Для индекса, собранного с --positions, операндом может быть и фраза
+# в кавычках, и "a NEAR/k b" - a и b не дальше k позиций друг от друга
+# в любом порядке (для фраз считается от начала фразы). Позиции декодируются
+# только для документов, прошедших пересечение по спискам документов.
+
+Phrase = namedtuple("Phrase", "terms")
+Near = namedtuple("Near", "k left right")
+
+QUERY_SYNTAX_RE = re.compile(r'("[^"]*"|NEAR/\d+)')
+
+
+def gallop(b: array, x: int, lo: int) -> int:
+    # первая позиция >= lo, где b[pos] >= x: шагами 1, 2, 4... затем бинпоиск
+    n = len(b)
+    step = 1
+    hi = lo
+    while hi < n and b[hi] < x:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect_left(b, x, lo, min(hi, n))
+
+
+def intersect(a: array, b: array) -> array:
+    # по короткому списку, в длинном прыгаем галопом
+    if len(a) > len(b):
+        a, b = b, a
+
+    res = array("I")
+    pos = 0
+    n = len(b)
+    for x in a:
+        pos = gallop(b, x, pos)
+        if pos == n:
+            break
+        if b[pos] == x:
+            res.append(x)
+            pos += 1
+    return res
+
+
+def union(a: array, b: array) -> array:
+    res = array("I")
+    i = j = 0
+    la, lb = len(a), len(b)
+
+    while i < la and j < lb:
+        x, y = a[i], b[j]
+        if x < y:
+            res.append(x)
+            i += 1
+        elif y < x:
+            res.append(y)
+            j += 1
+        else:
+            res.append(x)
+            i += 1
+            j += 1
+
+    res.extend(a[i:])
+    res.extend(b[j:])
+    return res
+
+
+def difference(a: array, b: array) -> array:
+    res = array("I")
+    pos = 0
+    n = len(b)
+    for x in a:
+        pos = gallop(b, x, pos)
+        if pos == n or b[pos] != x:
+            res.append(x)
+    return res
+
+
+def intersect_all(lists: list[array]) -> array:
+    # от самого короткого списка: промежуточный результат только уменьшается
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for lst in lists[1:]:
+        if not result:
+            break
+        result = intersect(result, lst)
+    return result
+
+
+def within(a, b, k: int) -> bool:
+    # есть ли в двух отсортированных списках позиций пара на расстоянии <= k
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if abs(a[i] - b[j]) <= k:
+            return True
+        if a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+def parse_operands(query: str) -> list:
+    # поток операторов и операндов: терм (str), Phrase или Near
+    items = []
+    near = None
+
+    for i, piece in enumerate(QUERY_SYNTAX_RE.split(query)):
+        if i % 2 == 0:
+            operands = tokenize_and_stem(piece)
+        elif piece.startswith("NEAR/"):
+            if items and items[-1] not in OPERATORS:
+                near = int(piece[5:])
+            continue
+        else:
+            terms = tuple(t for t in tokenize_and_stem(piece[1:-1]) if t not in OPERATORS)
+            if not terms:
+                continue
+            operands = [Phrase(terms) if len(terms) > 1 else terms[0]]
+
+        for x in operands:
+            if x in OPERATORS:
+                near = None
+                items.append(x)
+            elif near is not None:
+                items.append(Near(near, items.pop(), x))
+                near = None
+            else:
+                items.append(x)
+
+    return items
+
+
+def rank_terms(query: str) -> list[str]:
+    # операторы в ранжированном режиме не действуют: запрос - мешок термов
+    return [t for t in dict.fromkeys(tokenize_and_stem(query)) if t not in OPERATORS]
+
+
+def parse_query(query: str) -> tuple:
+    # первый операнд и [(оператор, операнд)]; как в C++, оператор перед первым
+    # термом не сбрасывается и достаётся второму
+    first = None
+    rest = []
+    op = "and"
+
+    for t in parse_operands(query):
+        if t in OPERATORS:
+            op = t
+            continue
+
+        if first is None:
+            first = t
+        else:
+            rest.append((op, t))
+            op = "and"
+
+    return first, rest
+
+
+class Index:
+    def __init__(self, path: str):
+        # path - каталог --out сборки, dir - текущее поколение в нём
+        self.path = path
+        self.dir = index_dir(path)
+
+        with open(os.path.join(self.dir, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+
+        self.doc_ids = []
+        doc_lens = array("I")
+        with open(os.path.join(self.dir, DOCS_FILE), encoding="utf-8", newline="\n") as f:
+            for line in f:
+                doc_id, length = line.rstrip("\n").split("\t")
+                self.doc_ids.append(doc_id)
+                doc_lens.append(int(length))
+        self.norms = doc_norms(doc_lens, self.meta["avgdl"])
+
+        # терм -> (df, смещение и длина в postings.bin, смещение и длина в tfs.bin,
+        # верхняя граница BM25, смещение и длина в positions.bin);
+        # сами списки читаются из mmap по запросу
+        self.terms = {}
+        with open(os.path.join(self.dir, TERMS_FILE), encoding="utf-8", newline="\n") as f:
+            for line in f:
+                term, df, offset, nbytes, tf_offset, tf_nbytes, bound, pos_offset, pos_nbytes = \
+                    line.rstrip("\n").split("\t")
+                self.terms[term] = (
+                    int(df), int(offset), int(nbytes), int(tf_offset), int(tf_nbytes), float(bound),
+                    int(pos_offset), int(pos_nbytes),
+                )
+
+        self._files = []
+        self._postings = self._map(POSTINGS_FILE)
+        self._tfs = self._map(TFS_FILE)
+        self._positions = self._map(POSITIONS_FILE) if self.meta.get("positions") else b""
+
+    def _map(self, name: str):
+        f = open(os.path.join(self.dir, name), "rb")
+        self._files.append(f)
+        size = os.fstat(f.fileno()).st_size
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def close(self):
+        for m in (self._postings, self._tfs, self._positions):
+            if isinstance(m, mmap.mmap):
+                m.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def df(self, term: str) -> int:
+        entry = self.terms.get(term)
+        return entry[0] if entry else 0
+
+    def postings(self, term: str) -> array:
+        entry = self.terms.get(term)
+        if entry is None:
+            return array("I")
+
+        _, offset, nbytes = entry[:3]
+        return decode_postings(self._postings, offset, offset + nbytes)
+
+    def tfs(self, term: str) -> array:
+        entry = self.terms.get(term)
+        if entry is None:
+            return array("I")
+
+        offset, nbytes = entry[3:5]
+        return decode_values(self._tfs, offset, offset + nbytes)
+
+    def positions(self, term: str, docs) -> dict[int, array]:
+        # позиции терма только в docs (отсортированы); блоки остальных
+        # документов перешагиваются по их длине без декодирования
+        if not self.meta.get("positions"):
+            raise ValueError("Index was built without --positions, phrase and NEAR queries are unavailable")
+
+        entry = self.terms.get(term)
+        if entry is None:
+            return {}
+
+        ids = self.postings(term)
+        buf = self._positions
+        pos = entry[6]
+        idx = 0
+        out = {}
+
+        for d in docs:
+            j = bisect_left(ids, d, idx)
+            if j == len(ids):
+                break
+            if ids[j] != d:
+                continue
+
+            while idx < j:
+                b = buf[pos]
+                if b < 0x80:
+                    pos += 1 + b
+                else:
+                    size, pos = read_varint_at(buf, pos)
+                    pos += size
+                idx += 1
+
+            size, pos = read_varint_at(buf, pos)
+            out[d] = decode_postings(buf, pos, pos + size)
+            pos += size
+            idx = j + 1
+
+        return out
+
+    def candidates(self, x) -> array:
+        # документы, где есть все термы операнда, - без проверки позиций
+        if isinstance(x, str):
+            return self.postings(x)
+
+        if isinstance(x, Phrase):
+            return intersect_all([self.postings(t) for t in x.terms])
+        return intersect_all([self.candidates(x.left), self.candidates(x.right)])
+
+    def matches(self, x, docs) -> dict[int, list[int]]:
+        # doc -> позиции совпадений операнда (для фраз - начала) среди docs
+        if isinstance(x, str):
+            return self.positions(x, docs)
+
+        if isinstance(x, Phrase):
+            # от редкого терма к частому: позиции частых термов декодируются
+            # только в документах, где фраза ещё возможна
+            starts = None
+            for i in sorted(range(len(x.terms)), key=lambda i: self.df(x.terms[i])):
+                found = self.positions(x.terms[i], docs)
+                alive = {}
+                for d, ps in found.items():
+                    s = {p - i for p in ps}
+                    if starts is not None:
+                        s &= starts[d]
+                    if s:
+                        alive[d] = s
+                starts = alive
+                docs = sorted(alive)
+                if not docs:
+                    break
+            return {d: sorted(s) for d, s in (starts or {}).items()}
+
+        out = {}
+
+        left = self.matches(x.left, docs)
+        right = self.matches(x.right, sorted(left))
+        for d, rpos in right.items():
+            lpos = left[d]
+            if within(lpos, rpos, x.k):
+                out[d] = sorted([*lpos, *rpos])
+        return out
+
+    def docs(self, x) -> array:
+        if isinstance(x, str):
+            return self.postings(x)
+        return array("I", sorted(self.matches(x, self.candidates(x))))
+
+    def ranked(self, query: str, k: int = 10) -> tuple[list[tuple[float, int]], dict]:
+        return self.rank_terms(rank_terms(query), k)
+
+    def rank_terms(self, terms: list[str], k: int) -> tuple[list[tuple[float, int]], dict]:
+        lists = []
+        n = len(self.doc_ids)
+        for term in terms:
+            entry = self.terms.get(term)
+            if entry is not None:
+                lists.append((idf(entry[0], n), entry[5], self.postings(term), self.tfs(term)))
+
+        return top_k(lists, self.norms, k)
+
+    def term_lists(self, terms: list[str]) -> list[array]:
+        return [self.postings(t) for t in terms]
+
+    def and_run(self, operands: list, acc: array | None = None) -> array:
+        # сначала пересечение на уровне документов: термы, acc и кандидаты
+        # фраз/NEAR без позиций; позиции декодируются только у документов,
+        # переживших его
+        terms = [x for x in operands if isinstance(x, str)]
+        exprs = [x for x in operands if not isinstance(x, str)]
+
+        lists = self.term_lists(terms) + [self.candidates(x) for x in exprs]
+        if acc is not None:
+            lists.append(acc)
+        result = intersect_all(lists)
+
+        for x in exprs:
+            if not result:
+                break
+            result = array("I", sorted(self.matches(x, result)))
+        return result
+
+    def search(self, query: str) -> array:
+        return self.evaluate(*parse_query(query))
+
+    def evaluate(self, first, rest: list) -> array:
+        if first is None:
+            return array("I")
+
+        # подряд идущие and коммутативны: пересекаем всю серию разом,
+        # в т.ч. ведущую, начиная с первого операнда
+        i = 0
+        run = [first]
+        while i < len(rest) and rest[i][0] == "and":
+            run.append(rest[i][1])
+            i += 1
+        result = self.and_run(run)
+
+        while i < len(rest):
+            op, term = rest[i]
+
+            if op == "and":
+                run = []
+                while i < len(rest) and rest[i][0] == "and":
+                    run.append(rest[i][1])
+                    i += 1
+                result = self.and_run(run, result)
+                continue
+
+            if op == "or":
+                result = union(result, self.docs(term))
+            else:
+                result = difference(result, self.docs(term))
+            i += 1
+
+        return result
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def fetch_titles(doc_ids: list[str]) -> dict[str, dict]:
+    # заголовки и url только для показываемых документов
+    client = MongoClient("mongodb://localhost:27017")
+    docs = client["ir_corpus"]["docs"]
+
+    oids = [ObjectId(i) for i in doc_ids if ObjectId.is_valid(i)]
+    return {str(d["_id"]): d for d in docs.find({"_id": {"$in": oids}}, {"title": 1, "url": 1})}
+
+
+def bench(index: Index, path: str, repeat: int, rank: bool = False, k: int = 10):
+    with open(path, encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    # фразовые запросы и NEAR считаем отдельно: у них своя цена
+    latencies = {"boolean": [], "phrase": []}
+    found = 0
+    postings = 0
+    skipped = 0
+    for _ in range(repeat):
+        for query in queries:
+            kind = "phrase" if not rank and ('"' in query or "NEAR/" in query) else "boolean"
+            start = time.perf_counter()
+            if rank:
+                hits, stats = index.ranked(query, k)
+                found += len(hits)
+                postings += stats["postings"]
+                skipped += stats["skipped"]
+            else:
+                found += len(index.search(query))
+            latencies[kind].append((time.perf_counter() - start) * 1000)
+
+    print(f"Queries: {len(queries)} x {repeat}, found total: {found // repeat}")
+    if rank:
+        print(f"Postings: {postings // repeat}, skipped by MaxScore: {skipped // repeat} ({skipped / max(postings, 1):.1%})")
+    for kind, values in latencies.items():
+        if values:
+            print(
+                f"Latency ms ({kind}, {len(values) // repeat}): p50 {percentile(values, 0.5):.3f}, "
+                f"p99 {percentile(values, 0.99):.3f}, max {max(values):.3f}, mean {sum(values) / len(values):.3f}"
+            )
+    if hasattr(index, "metrics"):
+        print("Cache:", ", ".join(f"{k} {v:.3f}" if isinstance(v, float) else f"{k} {v}" for k, v in index.metrics().items()))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("query", nargs="*")
+    ap.add_argument("--index", default="index_data")
+    ap.add_argument("--bench", default=None, help="файл с запросами, по одному в строке")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--rank", action="store_true", help="BM25 вместо булева поиска")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--cache-mb", type=int, default=0, help="кэш результатов, 0 - без кэша")
+    args = ap.parse_args()
+
+    if args.cache_mb:
+        from index.cache import CachedIndex, QueryCache
+        opened = CachedIndex(args.index, QueryCache(max_bytes=args.cache_mb << 20))
+    else:
+        opened = Index(args.index)
+
+    with opened as index:
+        print(f"Index loaded: {len(index.doc_ids)} documents, {len(index.terms)} terms")
+
+        if args.bench:
+            bench(index, args.bench, args.repeat, args.rank, args.top)
+            return
+
+        query = " ".join(args.query) or input("Enter query\n")
+        if not query:
+            print("Empty query")
+            return
+
+        if args.rank:
+            hits, stats = index.ranked(query, args.top)
+            print(f"Top {len(hits)}, postings: {stats['postings']}, skipped: {stats['skipped']}")
+
+            titles = fetch_titles([index.doc_ids[d] for _, d in hits])
+            for score, d in hits:
+                doc = titles.get(index.doc_ids[d], {})
+                print(f" {score:7.3f}  {index.doc_ids[d]}  {doc.get('title') or '-'}")
+                if doc.get("url"):
+                    print(f"          {doc['url']}")
+            return
+
+        try:
+            res = index.search(query)
+        except ValueError as e:
+            print(e)
+            return
+        print(f"Found: {len(res)} documents")
+        for i in res[:7]:
+            print(" - doc_id:", index.doc_ids[i])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import heapq
+import os
+import re
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+from itertools import islice
+
+# Порт tokenize_and_stem / stem_ru_en из main_linux.cpp.
+# C++ работает по байтам UTF-8, здесь - по символам, результат тот же:
+# длины в стеммере считаются в байтах, как в оригинале.
+#
+# Быстрый путь: регистр и ударения - одним str.translate, токены - одним
+# регулярным выражением, окончания - по таблицам, разбитым по длине.
+# Посимвольный порт оставлен как эталон (reference_tokenize) для проверки.
+#
+# Словарь корпуса на порядки меньше числа словоупотреблений (закон Ципфа),
+# поэтому стемминг идёт через ограниченный LRU-кэш форма -> основа.
+# warm_stem_cache заранее заполняет его самыми частыми формами из
+# form_freq.tsv (--dump-forms ниже). term_freq.tsv из tokenizer.cpp для
+# этого не годится: freq_dump считает уже основы, а кэш ключуется формами.
+
+OPERATORS = {"and", "or", "not"}
+
+EN_SUFFIXES = ("ing", "ion", "ed", "er", "s")
+
+# порядок важен: берётся первое совпавшее окончание
+RU_ENDINGS = (
+    "ами", "ями", "ого", "его", "ому", "ему",
+    "ыми", "ими", "ете", "ие", "ые", "ов", "ев",
+    "ий", "ия", "ая", "ой", "ую", "ое", "ым",
+    "ью", "ом", "ем", "ых", "ет", "ют", "ть",
+    "ый", "ок", "ам", "ах", "их",
+    "ей", "им", "ям", "ях",
+    "а", "у", "е", "и", "ы", "о", "ю", "я",
+)
+
+# в обоих списках длинные окончания идут раньше коротких, а окончаний одной
+# длины у слова может совпасть не больше одного - значит, первое совпадение
+# в списке = совпадение самой большой длины
+EN_BY_LEN = tuple((n, frozenset(e for e in EN_SUFFIXES if len(e) == n)) for n in (3, 2, 1))
+RU_BY_LEN = tuple((n, frozenset(e for e in RU_ENDINGS if len(e) == n)) for n in (3, 2, 1))
+
+ACCENT = "\u0301"
+
+MIN_LEN = 3
+MAX_LEN = 40
+
+STEM_CACHE_SIZE = 1 << 18
+
+# A-Z, А-Я, Ё в нижний регистр; ударение выкидываем
+LOWER = str.maketrans(
+    {
+        **{chr(c): chr(c + 32) for c in range(ord("A"), ord("Z") + 1)},
+        **{chr(c): chr(c + 32) for c in range(ord("А"), ord("Я") + 1)},
+        "Ё": "ё",
+        ACCENT: None,
+    }
+)
+
+# дефис входит в слово, если за ним латиница или символ U+0400-U+047F
+# (в C++ - байт 0xD0/0xD1); после translate латиница уже строчная
+TOKEN_RE = re.compile(r"[a-zа-яё](?:[a-zа-яё]|-(?=[a-z\u0400-\u047f]))*")
+
+
+def stem_ru_en(w: str) -> str:
+    # n - длина в байтах UTF-8: кириллица по 2 байта, латиница и дефис по 1
+    n = len(w.encode("utf-8"))
+
+    if n > 4:
+        for size, suffixes in EN_BY_LEN:
+            if w[-size:] in suffixes:
+                return w[:-size]
+
+    for size, endings in RU_BY_LEN:
+        if n > 2 * size + 2 and w[-size:] in endings:
+            return w[:-size]
+
+    return w
+
+
+cached_stem = lru_cache(maxsize=STEM_CACHE_SIZE)(stem_ru_en)
+warmed = 0
+# обращения к кэшу на прогреве - из статистики их вычитаем
+warm_hits = 0
+warm_misses = 0
+
+
+def configure_stem_cache(maxsize: int = STEM_CACHE_SIZE):
+    # новый пустой кэш; maxsize=0 - без кэша
+    global cached_stem, warmed, warm_hits, warm_misses
+    cached_stem = lru_cache(maxsize=maxsize)(stem_ru_en)
+    warmed = warm_hits = warm_misses = 0
+
+
+def warm_stem_cache(path: str, top_n: int = 50000) -> int:
+    # top_n самых частых форм из form_freq.tsv (форма \t частота)
+    global warmed, warm_hits, warm_misses
+
+    def rows():
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                word, _, freq = line.rstrip("\n").rpartition("\t")
+                if word and freq.isdigit():
+                    yield int(freq), word
+
+    before = cached_stem.cache_info()
+    for _, word in heapq.nlargest(top_n, rows()):
+        cached_stem(word)
+        warmed += 1
+    after = cached_stem.cache_info()
+    warm_hits += after.hits - before.hits
+    warm_misses += after.misses - before.misses
+    return warmed
+
+
+def stem_cache_stats() -> dict:
+    # обращения на прогреве не считаем
+    info = cached_stem.cache_info()
+    hits = info.hits - warm_hits
+    misses = info.misses - warm_misses
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "warmed": warmed,
+    }
+
+
+def tokenize_and_stem(text: str) -> list[str]:
+    if ACCENT in text:
+        # "-" перед ударением в C++ видит байт 0xCC и слово обрывает
+        text = text.replace("-" + ACCENT, " ")
+    text = text.translate(LOWER)
+
+    out = []
+    for token in TOKEN_RE.findall(text):
+        if token in OPERATORS:
+            out.append(token)
+            continue
+
+        # длина в буквах, дефисы не считаются
+        n = len(token) - token.count("-") if "-" in token else len(token)
+        if MIN_LEN <= n <= MAX_LEN:
+            out.append(cached_stem(token))
+
+    return out
+
+
+def surface_forms(text: str):
+    # формы, которые tokenize_and_stem отдаёт стеммеру, - ключи cached_stem
+    if ACCENT in text:
+        text = text.replace("-" + ACCENT, " ")
+    text = text.translate(LOWER)
+
+    for token in TOKEN_RE.findall(text):
+        if token in OPERATORS:
+            continue
+        n = len(token) - token.count("-") if "-" in token else len(token)
+        if MIN_LEN <= n <= MAX_LEN:
+            yield token
+
+
+# Посимвольный порт C++ - эталон для сверки
+
+def reference_stem(w: str) -> str:
+    n = len(w.encode("utf-8"))
+
+    if n > 4:
+        for suffix in EN_SUFFIXES:
+            if w.endswith(suffix):
+                return w[:-len(suffix)]
+
+    for e in RU_ENDINGS:
+        if n > 2 * len(e) + 2 and w.endswith(e):
+            return w[:-len(e)]
+
+    return w
+
+
+def is_letter(ch: str) -> bool:
+    return "a" <= ch <= "z" or "A" <= ch <= "Z" or "а" <= ch <= "я" or "А" <= ch <= "Я" or ch in "ёЁ"
+
+
+def hyphen_continues(ch: str) -> bool:
+    # C++ смотрит только на первый байт следующего символа: латиница или 0xD0/0xD1
+    return "a" <= ch <= "z" or "A" <= ch <= "Z" or "\u0400" <= ch <= "\u047f"
+
+
+def reference_flush(token: list, char_len: int, out: list):
+    word = "".join(token)
+    if word in OPERATORS:
+        out.append(word)
+    elif MIN_LEN <= char_len <= MAX_LEN:
+        out.append(reference_stem(word))
+
+
+def reference_tokenize(text: str) -> list[str]:
+    out: list[str] = []
+    token: list[str] = []
+    char_len = 0
+    n = len(text)
+
+    for i, ch in enumerate(text):
+        # ударение выкидываем, слово не прерывается
+        if ch == ACCENT:
+            continue
+
+        if is_letter(ch):
+            token.append(ch.lower())
+            char_len += 1
+            continue
+
+        if ch == "-" and token and i + 1 < n and hyphen_continues(text[i + 1]):
+            token.append(ch)
+            continue
+
+        reference_flush(token, char_len, out)
+        token.clear()
+        char_len = 0
+
+    reference_flush(token, char_len, out)
+    return out
+
+
+def read_texts(path: str, block: int = 4 << 20):
+    # corpus.tsv большими блоками; id документа отрезаем, как tokenizer.cpp
+    tail = b""
+    with open(path, "rb") as f:
+        while chunk := f.read(block):
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                yield line.partition(b"\t")[2].decode("utf-8")
+    if tail:
+        yield tail.partition(b"\t")[2].decode("utf-8")
+
+
+def dump_forms(path: str, out: str, limit: int | None = None) -> int:
+    # частоты форм по корпусу (первые limit документов) для warm_stem_cache
+    freq = Counter()
+    for text in islice(read_texts(path), limit):
+        freq.update(surface_forms(text))
+
+    with open(out, "w", encoding="utf-8", newline="\n") as f:
+        for form, n in freq.most_common():
+            f.write(f"{form}\t{n}\n")
+    return len(freq)
+
+
+def bench(path: str, fn) -> dict:
+    tokens = 0
+    length = 0
+    start = time.perf_counter()
+    for text in read_texts(path):
+        for t in fn(text):
+            tokens += 1
+            length += len(t)
+    seconds = time.perf_counter() - start
+    return {"tokens": tokens, "length": length, "seconds": seconds}
+
+
+def main():
+    # python -m index.tokenizer corpus.tsv [--check] [--warm form_freq.tsv]
+    # python -m index.tokenizer corpus.tsv --dump-forms form_freq.tsv [--limit N]
+    path = sys.argv[1] if len(sys.argv) > 1 else "corpus.tsv"
+    check = "--check" in sys.argv[2:]
+    warm = sys.argv[sys.argv.index("--warm") + 1] if "--warm" in sys.argv else None
+
+    if "--dump-forms" in sys.argv:
+        out = sys.argv[sys.argv.index("--dump-forms") + 1]
+        limit = int(sys.argv[sys.argv.index("--limit") + 1]) if "--limit" in sys.argv else None
+        print(f"Forms: {dump_forms(path, out, limit)} -> {out}")
+        return
+
+    kb = os.path.getsize(path) / 1024
+    runs = [("no stem cache", 0), (f"stem cache {STEM_CACHE_SIZE}", STEM_CACHE_SIZE)]
+    if check:
+        runs.append(("reference", None))
+
+    for name, cache_size in runs:
+        fn = reference_tokenize
+        if cache_size is not None:
+            fn = tokenize_and_stem
+            configure_stem_cache(cache_size)
+            if warm and cache_size:
+                print(f"Warmed stem cache with {warm_stem_cache(warm)} forms")
+
+        stats = bench(path, fn)
+        seconds = max(stats["seconds"], 1e-9)
+        print(f"\n=== {name} ===")
+        print("Tokens:", stats["tokens"])
+        print(f"Average stem length: {stats['length'] / max(stats['tokens'], 1):.2f}")
+        print(f"Time: {seconds:.2f} s")
+        print(f"Text: {kb:.0f} KB")
+        print(f"Speed: {kb / seconds:.0f} KB/s")
+        if cache_size:
+            cache = stem_cache_stats()
+            print(f"Stem cache: hit rate {cache['hit_rate']:.1%}, {cache['size']} forms")
+
+    if check:
+        mismatches = sum(1 for text in read_texts(path) if tokenize_and_stem(text) != reference_tokenize(text))
+        print("\nDocuments differing from reference:", mismatches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from lxml import etree
+
+# Вспомогательные функции для разбора на чистом lxml с той же семантикой,
+# что у BeautifulSoup(html, "lxml"): find_all, get_text, decompose.
+
+# строки внутри этих тегов BeautifulSoup не отдаёт в get_text()
+HIDDEN_STRING_TAGS = {"script", "style", "template", "rt", "rp"}
+
+# строку только из ASCII-пробелов BeautifulSoup ещё при разборе заменяет на
+# "\n" (если в ней был перевод строки) или " " - кроме строк внутри этих тегов
+PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+ASCII_SPACES = " \n\t\f\r"
+
+HTML_PARSER = etree.HTMLParser()
+HTML_PARSER_UTF8 = etree.HTMLParser(encoding="utf-8")
+
+
+def parse_html(html: str):
+    if not html:
+        return None
+    try:
+        return etree.fromstring(html, HTML_PARSER)
+    except ValueError:
+        # str с <?xml encoding=...?> lxml не принимает - отдаём байты
+        return etree.fromstring(html.encode("utf-8"), HTML_PARSER_UTF8)
+
+
+def has_class(el, name: str) -> bool:
+    cls = el.get("class")
+    return cls is not None and name in cls.split()
+
+
+def is_hidden(el) -> bool:
+    return any(a.tag in HIDDEN_STRING_TAGS for a in el.iterancestors())
+
+
+def iter_tags(root, names, removed=frozenset()):
+    # (тег, внутри script/style) в порядке документа, как find_all;
+    # removed - "удалённые" (decompose) элементы, их поддеревья пропускаются
+    stack = [(root, False)]
+    while stack:
+        el, hidden = stack.pop()
+
+        if el.tag in names:
+            yield el, hidden
+
+        hidden = hidden or el.tag in HIDDEN_STRING_TAGS
+        for child in reversed(el):
+            if isinstance(child.tag, str) and child not in removed:
+                stack.append((child, hidden))
+
+
+def collapse_space(s: str) -> str:
+    if s.strip(ASCII_SPACES):
+        return s
+    return "\n" if "\n" in s else " "
+
+
+def iter_strings(el, hidden=False, removed=frozenset(), preserve=True):
+    # preserve=False - пробельные строки заменяются, как в BeautifulSoup;
+    # для strip=True это ничего не меняет, поэтому по умолчанию не заменяем
+    hidden = hidden or el.tag in HIDDEN_STRING_TAGS
+    preserve = preserve or el.tag in PRESERVE_WHITESPACE_TAGS
+    if el.text and not hidden:
+        yield el.text if preserve else collapse_space(el.text)
+    for child in el:
+        # комментарии и удалённые теги пропускаем, но их хвостовой
+        # текст принадлежит el и остаётся отдельной строкой
+        if isinstance(child.tag, str) and child not in removed:
+            yield from iter_strings(child, hidden, removed, preserve)
+        if child.tail and not hidden:
+            yield child.tail if preserve else collapse_space(child.tail)
+
+
+def get_text(el, separator="", strip=False, hidden=False, removed=frozenset()) -> str:
+    if strip:
+        strings = iter_strings(el, hidden, removed)
+        return separator.join(s for s in (s.strip() for s in strings) if s)
+
+    preserve = any(a.tag in PRESERVE_WHITESPACE_TAGS for a in el.iterancestors())
+    return separator.join(iter_strings(el, hidden, removed, preserve))
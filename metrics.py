@@ -0,0 +1,261 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# Общие метрики краулера, парсера и экспорта: гистограммы времени по этапам
+# (fetch, save, parse, upsert, export, ...) и счётчики. Реестр один на
+# процесс - модульный, чтобы этапы можно было замерять в Fetcher, BulkWriter
+# и т.п. без протаскивания объекта через все функции.
+#
+# Запросы к Mongo считает CommandTimer (pymongo command monitoring): время
+# по коллекции и команде, включая bulk_write и getMore курсоров.
+#
+# start(path) раз в interval секунд атомарно переписывает файл: *.json -
+# JSON, иначе текстовый формат Prometheus (подходит для node_exporter
+# textfile collector).
+
+PREFIX = "ir_"
+
+# границы корзин гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# служебные команды драйвера в метрики не попадают
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # верхняя граница корзины, в которую попал квантиль
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(float)
+        self.started = time.time()
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.histograms[key].observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            histograms = [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": h.count,
+                    "sum": h.sum,
+                    "max": h.max,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                    "p99": h.quantile(0.99),
+                    "buckets": list(h.counts),
+                }
+                for (name, labels), h in sorted(self.histograms.items())
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {
+            "generated_at": time.time(),
+            "uptime": time.time() - self.started,
+            "histograms": histograms,
+            "counters": counters,
+        }
+
+
+REGISTRY = Registry()
+
+
+def observe(name: str, value: float, **labels):
+    REGISTRY.observe(name, value, **labels)
+
+
+def inc(name: str, value: float = 1, **labels):
+    REGISTRY.inc(name, value, **labels)
+
+
+@contextmanager
+def timer(stage: str, **labels):
+    # время этапа, в т.ч. если внутри исключение или await
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe("stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+
+class CommandTimer(monitoring.CommandListener):
+    def __init__(self, registry: Registry = REGISTRY):
+        self.registry = registry
+        self.pending = {}
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        # для find/insert/update/... имя коллекции - значение первого ключа,
+        # для getMore - поле collection
+        target = event.command.get(event.command_name)
+        if not isinstance(target, str):
+            target = event.command.get("collection", "")
+        self.pending[(event.connection_id, event.request_id)] = (f"{event.database_name}.{target}", event.command_name)
+
+    def _finish(self, event, failed: bool):
+        slot = self.pending.pop((event.connection_id, event.request_id), None)
+        if slot is None:
+            return
+        collection, op = slot
+        self.registry.observe("mongo_command_seconds", event.duration_micros / 1e6, collection=collection, op=op)
+        if failed:
+            self.registry.inc("mongo_command_errors", collection=collection, op=op)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+
+def label_text(labels: dict, **extra) -> str:
+    items = {**labels, **extra}
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in items.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(items, escaped)) + "}"
+
+
+def to_prometheus(snap: dict) -> str:
+    lines = []
+    typed = set()
+
+    for h in snap["histograms"]:
+        name = PREFIX + h["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), h["buckets"]):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{label_text(h['labels'], le=le)} {cumulative}")
+        lines.append(f"{name}_sum{label_text(h['labels'])} {h['sum']:.6f}")
+        lines.append(f"{name}_count{label_text(h['labels'])} {h['count']}")
+
+    for c in snap["counters"]:
+        name = PREFIX + c["name"] + "_total"
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{label_text(c['labels'])} {c['value']:g}")
+
+    return "\n".join(lines) + "\n"
+
+
+def dump(path: str, registry: Registry = REGISTRY):
+    # через временный файл: читатель не увидит наполовину записанный
+    snap = registry.snapshot()
+    if path.endswith(".json"):
+        data = json.dumps(snap, ensure_ascii=False, indent=1)
+    else:
+        data = to_prometheus(snap)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class Dumper(threading.Thread):
+    def __init__(self, path: str, interval: float = 15.0, registry: Registry = REGISTRY):
+        super().__init__(daemon=True, name="metrics-dumper")
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                dump(self.path, self.registry)
+            except OSError as e:
+                print(f"[METRICS] dump failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        dump(self.path, self.registry)
+
+
+dumper: Dumper | None = None
+
+
+def start(path: str | None, interval: float = 15.0):
+    # path=None - метрики только копятся, report всё равно работает
+    global dumper
+    if not path or dumper is not None:
+        return
+    dumper = Dumper(path, interval)
+    dumper.start()
+    atexit.register(stop)
+
+
+def stop():
+    global dumper
+    if dumper is not None:
+        dumper.stop()
+        dumper = None
+
+
+def report(registry: Registry = REGISTRY, top: int = 15):
+    # самые дорогие по суммарному времени этапы и запросы к Mongo
+    snap = registry.snapshot()
+    rows = sorted(snap["histograms"], key=lambda h: h["sum"], reverse=True)[:top]
+
+    print("\n[METRICS]")
+    for h in rows:
+        labels = ",".join(f"{k}={v}" for k, v in h["labels"].items())
+        mean = h["sum"] / max(h["count"], 1)
+        print(
+            f"    {h['name']}[{labels}]: {h['count']} x {mean * 1000:.1f} ms = {h['sum']:.1f} s, "
+            f"p95 <= {h['p95'] * 1000:.1f} ms, max {h['max'] * 1000:.1f} ms"
+        )
+    for c in snap["counters"]:
+        labels = ",".join(f"{k}={v}" for k, v in c["labels"].items())
+        print(f"    {c['name']}[{labels}]: {c['value']:g}")
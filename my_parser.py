@@ -1,18 +1,38 @@
-from pymongo import MongoClient
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from pymongo import DeleteOne, MongoClient, UpdateOne
 from bs4 import BeautifulSoup
 from tqdm import tqdm
 
+import metrics
+from bulk_writer import BulkWriter
+from dedup import THRESHOLD, NearDuplicates, from_bytes, signature
+from htmlstore import HtmlStore
 from parser_securitylab import parse_securitylab_article
-from parser_wiki import parse_title, parse_summary, parse_article_text
+from parser_wiki import parse_title, parse_summary, parse_article_text, parse_lxml
 
 RAW_DB = "ir_crawler"
 RAW_COLLECTION = "pages"
 
 CLEAN_DB = "ir_corpus"
 CLEAN_COLLECTION = "docs"
+SKIPPED_COLLECTION = "skipped"
+
+# увеличивать при любом изменении логики парсеров - тогда всё перепарсится
+PARSER_VERSION = 2
+
+RAW_FIELDS = {"url": 1, "html": 1, "source": 1, "content_hash": 1}
 
 
-def parse_wikipedia(html: str) -> dict:
+def parse_wikipedia(html: str, engine: str = "bs4") -> dict:
+    if engine == "lxml":
+        return parse_lxml(html)
+
     soup = BeautifulSoup(html, "lxml")
     return {
         "title": parse_title(soup),
@@ -21,66 +41,224 @@ def parse_wikipedia(html: str) -> dict:
     }
 
 
+def parse_document(doc, engine: str = "bs4") -> dict | None:
+    url = doc.get("url")
+    html = doc.get("html")
+    source = doc.get("source")
+
+    if not html or not source:
+        return None
+
+    try:
+        if source == "securitylab" or source == "securitynews":
+            parsed = parse_securitylab_article(html)
+        elif source == "wikipedia":
+            parsed = parse_wikipedia(html, engine)
+        else:
+            return None
+
+        title = parsed.get("title")
+        text = parsed.get("text")
+
+        if not title or not text or len(text) < 200:
+            return None
+
+        return {
+            "url": url,
+            "source": source,
+            "title": title,
+            "summary": parsed.get("summary"),
+            "text": text,
+        }
+
+    except Exception:
+        return None
+
+
+def parse_batch(docs: list, engine: str = "bs4", dedup: bool = False) -> list:
+    # время разбора меряется в воркере и возвращается вместе с результатом:
+    # метрики воркеров пула в основной процесс сами не попадают
+    out = []
+    for doc in docs:
+        start = time.perf_counter()
+        result = parse_document(doc, engine)
+        parsed = time.perf_counter()
+        timings = {"parse": parsed - start}
+
+        # сигнатура MinHash считается в воркере, в основном процессе - только поиск LSH;
+        # время - только когда она действительно считалась
+        if dedup and result is not None:
+            sig = signature(result["text"])
+            timings["minhash"] = time.perf_counter() - parsed
+            if sig is not None:
+                result["minhash"] = sig.tobytes()
+
+        out.append((doc.get("url"), doc.get("content_hash"), result, timings))
+    return out
+
+
+def load_parsed_state(clean, skipped) -> dict:
+    # url -> {(content_hash, parser_version)} по уже разобранным и пропущенным страницам
+    state = {}
+    for coll in (clean, skipped):
+        for doc in coll.find({}, {"url": 1, "content_hash": 1, "parser_version": 1}):
+            state.setdefault(doc["url"], set()).add((doc.get("content_hash"), doc.get("parser_version")))
+    return state
+
+
+def find_changed(raw, state: dict) -> list:
+    # без html: из pages тянем только url и хэш
+    changed = []
+    for doc in raw.find({}, {"url": 1, "content_hash": 1}, batch_size=5000):
+        if (doc.get("content_hash"), PARSER_VERSION) not in state.get(doc.get("url"), ()):
+            changed.append(doc["_id"])
+    return changed
+
+
+def fetch_raw(raw, ids: list, size: int, store: HtmlStore):
+    # html новых страниц лежит сжатым в blobs - распаковываем здесь,
+    # парсеры получают документы в прежнем виде
+    for i in range(0, len(ids), size):
+        with metrics.timer("read_raw"):
+            docs = store.fill(list(raw.find({"_id": {"$in": ids[i:i + size]}}, RAW_FIELDS)))
+        yield from docs
+
+
+def batched(docs, size: int):
+    docs = iter(docs)
+    while batch := list(islice(docs, size)):
+        yield batch
+
+
+def parse_stream(docs, workers: int, batch_size: int, engine: str = "bs4", dedup: bool = False):
+    if workers <= 1:
+        for batch in batched(docs, batch_size):
+            yield parse_batch(batch, engine, dedup)
+        return
+
+    # читатель отдаёт пачки в пул, держим не больше workers*2 пачек в работе,
+    # чтобы html не копился в памяти быстрее, чем его разбирают
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        for batch in batched(docs, batch_size):
+            pending.append(pool.submit(parse_batch, batch, engine, dedup))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
 def main():
-    client = MongoClient("mongodb://localhost:27017")
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("--full", action="store_true", help="перепарсить всё, игнорируя content_hash")
+    ap.add_argument("--wiki-engine", choices=["bs4", "lxml"], default="bs4")
+    ap.add_argument("--no-dedup", action="store_true", help="не искать почти-дубликаты")
+    ap.add_argument("--dedup-threshold", type=float, default=THRESHOLD)
+    ap.add_argument("--metrics", help="файл метрик: *.json или формат Prometheus")
+    ap.add_argument("--metrics-interval", type=float, default=15)
+    args = ap.parse_args()
+
+    metrics.start(args.metrics, args.metrics_interval)
+    client = MongoClient("mongodb://localhost:27017", event_listeners=[metrics.CommandTimer()])
 
     raw = client[RAW_DB][RAW_COLLECTION]
     clean = client[CLEAN_DB][CLEAN_COLLECTION]
 
+    skipped_coll = client[CLEAN_DB][SKIPPED_COLLECTION]
+
     clean.create_index("url", unique=True)
+    skipped_coll.create_index("url", unique=True)
+    writer = BulkWriter(clean)
+    skipped_writer = BulkWriter(skipped_coll)
 
     total = raw.count_documents({})
-    print(f"Found raw documents: {total}")
-
-    ok, skipped = 0, 0
-
-    for doc in tqdm(raw.find({})):
-        url = doc.get("url")
-        html = doc.get("html")
-        source = doc.get("source")
-
-        if not html or not source:
-            skipped += 1
-            continue
-
-        try:
-            if source == "securitylab" or source == "securitynews":
-                parsed = parse_securitylab_article(html)
-            elif source == "wikipedia":
-                parsed = parse_wikipedia(html)
-            else:
-                skipped += 1
-                continue
-
-            title = parsed.get("title")
-            text = parsed.get("text")
-
-            if not title or not text or len(text) < 200:
-                skipped += 1
-                continue
-
-            result = {
-                "url": url,
-                "source": source,
-                "title": title,
-                "summary": parsed.get("summary"),
-                "text": text,
-            }
-
-            clean.update_one(
-                {"url": url},
-                {"$set": result},
-                upsert=True
-            )
-
-            ok += 1
-
-        except Exception:
-            skipped += 1
+    print(f"Found raw documents: {total}, workers: {args.workers}")
+
+    state = {} if args.full else load_parsed_state(clean, skipped_coll)
+    ids = find_changed(raw, state)
+    print(f"Changed since last parse: {len(ids)}")
+
+    # почти-дубликаты ищутся среди уже разобранных документов и разобранных
+    # в этом запуске; дубликат в docs не попадает, а уходит в skipped со
+    # ссылкой duplicate_of, так что export и индекс его не видят
+    dedup = None
+    if not args.no_dedup:
+        dedup = NearDuplicates(args.dedup_threshold)
+        print(f"Loaded signatures: {dedup.load(clean)}")
+
+    ok, skipped, duplicates = 0, 0, 0
+    docs = fetch_raw(raw, ids, 500, HtmlStore(client[RAW_DB]))
+
+    try:
+        with tqdm(total=len(ids)) as bar:
+            for results in parse_stream(docs, args.workers, args.batch, args.wiki_engine, dedup is not None):
+                for url, content_hash, result, timings in results:
+                    version = {"content_hash": content_hash, "parser_version": PARSER_VERSION}
+                    for stage, seconds in timings.items():
+                        metrics.observe("stage_seconds", seconds, stage=stage)
+
+                    if result is None:
+                        skipped_writer.add(UpdateOne(
+                            {"url": url},
+                            {"$set": {"url": url, **version}, "$unset": {"duplicate_of": "", "similarity": ""}},
+                            upsert=True
+                        ))
+                        # изменившаяся страница перестала разбираться - старый текст
+                        # из docs убираем, иначе он так и будет выгружаться
+                        writer.add(DeleteOne({"url": url}))
+                        if dedup is not None:
+                            dedup.discard(url)
+                        skipped += 1
+                        continue
+
+                    if dedup is not None and "minhash" in result:
+                        sig = from_bytes(result["minhash"])
+                        with metrics.timer("dedup"):
+                            match = dedup.find(url, sig)
+                        if match:
+                            original, similarity = match
+                            skipped_writer.add(UpdateOne(
+                                {"url": url},
+                                {"$set": {"url": url, **version, "duplicate_of": original,
+                                          "similarity": round(similarity, 3)}},
+                                upsert=True
+                            ))
+                            # страница могла быть в docs с прошлого разбора
+                            writer.add(DeleteOne({"url": url}))
+                            dedup.discard(url)
+                            duplicates += 1
+                            continue
+                        dedup.add(url, sig)
+
+                    # updated_at - водяной знак для инкрементального export.py; ставит
+                    # сервер в момент записи, а не здесь: операция может долго
+                    # пролежать в буфере BulkWriter
+                    update = {"$set": {**result, **version}, "$currentDate": {"updated_at": True}}
+                    if "minhash" not in result:
+                        # с --no-dedup сигнатура не считалась - старая от прежнего
+                        # текста не должна достаться следующему запуску с дедупом
+                        update["$unset"] = {"minhash": ""}
+                    writer.add(UpdateOne({"url": url}, update, upsert=True))
+                    ok += 1
+
+                bar.update(len(results))
+    finally:
+        # в т.ч. при Ctrl+C - уже разобранное не теряем
+        writer.flush()
+        skipped_writer.flush()
+        metrics.stop()
 
     print("\nDone.")
     print(f"Saved: {ok}")
     print(f"Skipped: {skipped}")
+    if dedup is not None:
+        stats = dedup.stats()
+        print(f"Near-duplicates: {duplicates} (candidates per lookup: {stats['candidates_per_lookup']:.2f})")
+    metrics.report()
 
 
 if __name__ == "__main__":
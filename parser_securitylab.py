@@ -1,24 +1,8 @@
-import re
+import sys
 from bs4 import BeautifulSoup
 
-
-def clean_text(text: str) -> str:
-    if not text:
-        return ""
-
-    # схлопываем пробелы и переносы
-    text = re.sub(r"\s+", " ", text)
-
-    # убираем пробелы перед пунктуацией
-    text = re.sub(r"\s+([,.:;!?»])", r"\1", text)
-
-    # убираем пробелы после открывающих скобок/кавычек
-    text = re.sub(r"([(\[{«„‚])\s+", r"\1", text)
-
-    # убираем пробелы перед закрывающими скобками/кавычками
-    text = re.sub(r"\s+([)\]}»“’])", r"\1", text)
-
-    return text.strip()
+from lxml_text import get_text, has_class, is_hidden, iter_tags, parse_html
+from text_clean import clean_news_text as clean_text
 
 
 def get_meta(soup: BeautifulSoup, *, name: str | None = None, prop: str | None = None) -> str | None:
@@ -133,7 +117,7 @@ def parse_article_text(soup: BeautifulSoup) -> str | None:
 
 
 
-def parse_securitylab_article(html: str, base_url: str = "https://www.securitylab.ru") -> dict:
+def parse_securitylab_article_bs4(html: str, base_url: str = "https://www.securitylab.ru") -> dict:
    
     soup = BeautifulSoup(html, "lxml")
 
@@ -149,7 +133,162 @@ def parse_securitylab_article(html: str, base_url: str = "https://www.securityla
 
 
 
+# Однопроходный разбор на lxml: контейнер статьи ищется один раз, шум
+# вырезается один раз, аннотация и текст берутся из одного обхода.
+# Результат совпадает с parse_securitylab_article_bs4.
+
+ARTICLE_TAGS = {"p", "h2", "h3", "h4", "h5", "h6", "li"}
+NOISE_TAGS = {"script", "style", "noscript", "iframe"}
+NOISE_CLASSES = ("banner-detailed", "webinar-banner", "promo-banner", "share-block")
+
+HEADING_PREFIX = {"h2": "\n# ", "h3": "\n## ", "h4": "\n### ", "h5": "\n#### ", "h6": "\n##### "}
+
+
+def get_meta_lxml(root, *, name: str | None = None, prop: str | None = None) -> str | None:
+    if name:
+        attr, value = "name", name
+    elif prop:
+        attr, value = "property", prop
+    else:
+        return None
+
+    for tag in root.iter("meta"):
+        if tag.get(attr) == value:
+            content = tag.get("content")
+            return clean_text(content) if content else None
+    return None
+
+
+def parse_title_lxml(root) -> str | None:
+    t = get_meta_lxml(root, prop="og:title")
+    if t:
+        return t
+
+    for h1 in root.iter("h1"):
+        if "page-title" in (h1.get("class") or ""):
+            return clean_text(get_text(h1, " ", strip=True, hidden=is_hidden(h1)))
+
+    for title in root.iter("title"):
+        return clean_text(get_text(title, " ", strip=True, hidden=is_hidden(title)))
+
+    return None
+
+
+def find_article_container_lxml(root):
+    for div in root.iter("div"):
+        if has_class(div, "articl-text") and div.get("itemscope") is not None:
+            return div
+    return None
+
+
+def find_noise(article) -> frozenset:
+    # аналог remove_noise: элементы не удаляются из дерева (lxml склеил бы
+    # соседние строки), а пропускаются при обходе
+    removed = set()
+
+    for div in article.iter("div"):
+        if div is article:
+            continue
+        cls = div.get("class")
+        if cls and any(c in cls for c in NOISE_CLASSES):
+            removed.add(div)
+
+    for tag, _ in iter_tags(article, NOISE_TAGS, frozenset(removed)):
+        if tag is not article:
+            removed.add(tag)
+
+    return frozenset(removed)
+
+
+def extract_article(article, removed) -> tuple[str | None, str | None]:
+    summary = None
+    summary_found = False
+
+    texts: list[str] = []
+    seen = set()
+    first_p_skipped = False
+
+    for tag, hidden in iter_tags(article, ARTICLE_TAGS, removed):
+        name = tag.tag
+        txt = clean_text(get_text(tag, " ", strip=True, hidden=hidden, removed=removed))
+
+        # первый <p> - lead-аннотация
+        if name == "p" and not summary_found:
+            summary_found = True
+            summary = txt if len(txt) >= 10 else None
+
+        if not txt:
+            continue
+
+        if txt in seen:
+            continue
+
+        seen.add(txt)
+
+        if name == "p" and not first_p_skipped:
+            first_p_skipped = True
+            continue
+
+        if name == "p" and len(txt) < 25:
+            continue
+
+        if name in HEADING_PREFIX:
+            texts.append(HEADING_PREFIX[name] + txt)
+        elif name == "li":
+            texts.append(f"- {txt}")
+        else:
+            texts.append(txt)
+
+    out = "\n".join(texts).strip()
+    return summary, out or None
+
+
+def parse_securitylab_article(html: str, base_url: str = "https://www.securitylab.ru") -> dict:
+    root = parse_html(html)
+    if root is None:
+        return {"title": None, "summary": None, "text": None}
+
+    title = parse_title_lxml(root)
+    summary, text = None, None
+
+    article = find_article_container_lxml(root)
+    if article is not None:
+        summary, text = extract_article(article, find_noise(article))
+
+    return {
+        "title": title,
+        "summary": summary,
+        "text": text,
+    }
+
+
+def compare_engines(paths) -> bool:
+    ok = True
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        expected = parse_securitylab_article_bs4(html)
+        actual = parse_securitylab_article(html)
+
+        diff = [field for field in ("title", "summary", "text") if expected[field] != actual[field]]
+        if diff:
+            ok = False
+            for field in diff:
+                print(f"DIFF {path} [{field}]:")
+                print(f"    bs4:  {expected[field]!r:.200}")
+                print(f"    lxml: {actual[field]!r:.200}")
+        else:
+            print(f"OK   {path}")
+
+    return ok
+
+
 def main():
+    # python parser_securitylab.py --compare page1.html page2.html ...
+    if len(sys.argv) > 2 and sys.argv[1] == "--compare":
+        sys.exit(0 if compare_engines(sys.argv[2:]) else 1)
+
     filename = "secnews_5.html"
 
     with open(filename, encoding="utf-8") as f:
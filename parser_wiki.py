@@ -1,6 +1,10 @@
 import re
+import sys
 from bs4 import BeautifulSoup
 
+from lxml_text import HIDDEN_STRING_TAGS, get_text, has_class, is_hidden, parse_html
+from text_clean import clean_wiki_text as clean_text
+
 def parse_title(soup):
     if soup.title:
         return soup.title.get_text(strip=True)
@@ -107,33 +111,170 @@ def parse_article_text(soup):
     return "\n".join(texts)
 
 
-def clean_text(text: str) -> str:
+# Движок на чистом lxml: тот же результат, что parse_title/parse_summary/
+# parse_article_text поверх BeautifulSoup, но без построения дерева bs4
+# и без find_parent на каждый тег.
+
+ARTICLE_TAGS = {"p", "h2", "h3", "h4", "h5", "h6", "li", "dd", "pre", "code"}
+SUMMARY_TAGS = {"p", "h2"}
+
+STOP_SECTIONS = {
+    "См. также",
+    "Примечания",
+    "Ссылки",
+    "Список литературы",
+}
 
-    # убираем сноски вида [1], [ 2 ] и т д
-    text = re.sub(r"\[\s*\d+\s*\]", "", text)
+HEADING_PREFIX = {"h3": "\n## ", "h4": "\n### ", "h5": "\n#### ", "h6": "\n##### "}
 
-    text = re.sub(r"\[\s*[A-Za-zА-Яа-я]\s*\d+\s*\]", "", text)
-    
-    
-    text = re.sub(r"\[(источник не указан|не подтверждено|уточнить)[^\]]*\]", "", text, flags=re.IGNORECASE)
+SECTION_NUMBER_RE = re.compile(r"^\d+(\.\d+)*\s+")
 
-    # убираем пробелы перед пунктуацией
-    text = re.sub(r"\s+([,.:;!?»])", r"\1", text)
 
-    # убираем пробелы после открывающих скобок и кавычек
-    text = re.sub(r"([(\[{«„‚])\s+", r"\1", text)
+def _walk(root, names, skip_ambox):
+    # (тег, внутри ambox, внутри script/style) в порядке документа, как find_all
+    stack = [(root, False, False)]
+    while stack:
+        el, in_ambox, hidden = stack.pop()
 
-    # убираем пробелы перед закрывающими скобками и кавычками
-    text = re.sub(r"\s+([)\]}»“’])", r"\1", text)
+        if el.tag in names:
+            yield el, in_ambox, hidden
+
+        ambox = has_class(el, "ambox")
+        if ambox and skip_ambox:
+            continue
 
-    text = re.sub(r"\{\\displaystyle.*?\}", "", text)
+        children = [c for c in el if isinstance(c.tag, str)]
+        in_ambox = in_ambox or ambox
+        hidden = hidden or el.tag in HIDDEN_STRING_TAGS
+        for child in reversed(children):
+            stack.append((child, in_ambox, hidden))
 
-    # схлопываем все лишние пробелы
-    text = re.sub(r"\s+", " ", text).strip()
 
-    return text.strip()
+def parse_title_lxml(root):
+    for el in root.iter("title"):
+        return get_text(el, strip=True, hidden=is_hidden(el))
+    return None
+
+
+def parse_summary_lxml(root):
+    texts = []
+
+    for tag, in_ambox, hidden in _walk(root, SUMMARY_TAGS, skip_ambox=False):
+
+        if tag.tag == "h2":
+            break
+
+        if in_ambox:
+            continue
+
+        text = clean_text(get_text(tag, " ", strip=True, hidden=hidden))
+        if not text or len(text) < 30:
+            continue
+
+        texts.append(text)
+
+    return "\n\n".join(texts)
+
+
+def parse_article_text_lxml(root):
+    texts = []
+    in_article = False
+
+    for tag, _, hidden in _walk(root, ARTICLE_TAGS, skip_ambox=True):
+        name = tag.tag
+
+        # до первого h2 всё равно ничего не берём - текст не считаем
+        if not in_article and name != "h2":
+            continue
+
+        text = clean_text(get_text(tag, " ", strip=True, hidden=hidden))
+        if not text:
+            continue
+
+        if text.lower() == "содержание":
+            continue
+
+        if SECTION_NUMBER_RE.match(text):
+            continue
+
+        if name == "h2":
+            if text in STOP_SECTIONS:
+                break
+
+            in_article = True
+            texts.append(f"\n# {text}")
+            continue
+
+        if name in HEADING_PREFIX:
+            texts.append(HEADING_PREFIX[name] + text)
+
+        elif name == "li" or name == "dd":
+            texts.append(f"- {text}")
+
+        elif name == "p":
+            if len(text) >= 30:
+                texts.append(text)
+
+        elif name == "pre" or name == "code":
+            code_text = get_text(tag, hidden=hidden).strip()
+            if code_text:
+                texts.append(f"\n```\n{code_text}\n```")
+
+    return "\n".join(texts)
+
+
+def parse_lxml(html: str) -> dict:
+    root = parse_html(html)
+    if root is None:
+        return {"title": None, "summary": "", "text": ""}
+
+    return {
+        "title": parse_title_lxml(root),
+        "summary": parse_summary_lxml(root),
+        "text": parse_article_text_lxml(root),
+    }
+
+
+def parse_bs4(html: str) -> dict:
+    soup = BeautifulSoup(html, "lxml")
+    return {
+        "title": parse_title(soup),
+        "summary": parse_summary(soup),
+        "text": parse_article_text(soup),
+    }
+
+
+def compare_engines(paths) -> bool:
+    ok = True
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+
+        expected = parse_bs4(html)
+        actual = parse_lxml(html)
+
+        for field in ("title", "summary", "text"):
+            if expected[field] == actual[field]:
+                continue
+
+            ok = False
+            a, b = expected[field] or "", actual[field] or ""
+            pos = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+            print(f"DIFF {path} [{field}] at {pos}:")
+            print(f"    bs4:  {a[max(0, pos - 40):pos + 40]!r}")
+            print(f"    lxml: {b[max(0, pos - 40):pos + 40]!r}")
+            break
+        else:
+            print(f"OK   {path}")
+
+    return ok
+
 
 def main():
+    # python parser_wiki.py --compare page1.html page2.html ...
+    if len(sys.argv) > 2 and sys.argv[1] == "--compare":
+        sys.exit(0 if compare_engines(sys.argv[2:]) else 1)
+
     with open("wiki_0.html", encoding="utf-8") as f:
         html = f.read()
 
@@ -0,0 +1,109 @@
+import re
+import sys
+import time
+
+# Общая нормализация текста для parser_wiki и parser_securitylab.
+# Все шаблоны компилируются один раз при импорте.
+
+# сноски вида [1], [ 2 ] и т д
+FOOTNOTE_RE = re.compile(r"\[\s*\d+\s*\]")
+FOOTNOTE_LETTER_RE = re.compile(r"\[\s*[A-Za-zА-Яа-я]\s*\d+\s*\]")
+CITATION_NEEDED_RE = re.compile(r"\[(источник не указан|не подтверждено|уточнить)[^\]]*\]", re.IGNORECASE)
+DISPLAYSTYLE_RE = re.compile(r"\{\\displaystyle.*?\}")
+
+# три правила про пробелы у пунктуации одним проходом:
+# пробелы перед , . : ; ! ? » ) ] } “ ’ и после ( [ { « „ ‚
+PUNCT_SPACE_RE = re.compile(r"\s+(?=[,.:;!?»)\]}“’])|(?<=[(\[{«„‚])\s+")
+
+
+def collapse_spaces(text: str) -> str:
+    # то же, что re.sub(r"\s+", " ", text).strip()
+    return " ".join(text.split())
+
+
+def clean_wiki_text(text: str) -> str:
+    # сноски убираются по очереди: удаление одной может открыть следующую
+    text = FOOTNOTE_RE.sub("", text)
+    text = FOOTNOTE_LETTER_RE.sub("", text)
+    text = CITATION_NEEDED_RE.sub("", text)
+
+    text = PUNCT_SPACE_RE.sub("", text)
+    text = DISPLAYSTYLE_RE.sub("", text)
+
+    return collapse_spaces(text)
+
+
+def clean_news_text(text: str) -> str:
+    if not text:
+        return ""
+
+    return PUNCT_SPACE_RE.sub("", collapse_spaces(text))
+
+
+# Исходные версии из парсеров - эталон для проверки идентичности в бенчмарке
+
+def reference_wiki_text(text: str) -> str:
+    text = re.sub(r"\[\s*\d+\s*\]", "", text)
+    text = re.sub(r"\[\s*[A-Za-zА-Яа-я]\s*\d+\s*\]", "", text)
+    text = re.sub(r"\[(источник не указан|не подтверждено|уточнить)[^\]]*\]", "", text, flags=re.IGNORECASE)
+    text = re.sub(r"\s+([,.:;!?»])", r"\1", text)
+    text = re.sub(r"([(\[{«„‚])\s+", r"\1", text)
+    text = re.sub(r"\s+([)\]}»“’])", r"\1", text)
+    text = re.sub(r"\{\\displaystyle.*?\}", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.strip()
+
+
+def reference_news_text(text: str) -> str:
+    if not text:
+        return ""
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s+([,.:;!?»])", r"\1", text)
+    text = re.sub(r"([(\[{«„‚])\s+", r"\1", text)
+    text = re.sub(r"\s+([)\]}»“’])", r"\1", text)
+    return text.strip()
+
+
+def load_sample(path: str, limit: int, fragment: int = 300) -> list[str]:
+    # режем документы corpus.tsv на куски размером с типичный <p>/<li>
+    sample = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            _, _, text = line.partition("\t")
+            for i in range(0, len(text), fragment):
+                sample.append(text[i:i + fragment])
+                if len(sample) >= limit:
+                    return sample
+    return sample
+
+
+def bench(fn, sample) -> float:
+    start = time.perf_counter()
+    for text in sample:
+        fn(text)
+    return (time.perf_counter() - start) / len(sample) * 1e6
+
+
+def main():
+    # python text_clean.py corpus.tsv [кол-во фрагментов]
+    path = sys.argv[1] if len(sys.argv) > 1 else "corpus.tsv"
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+
+    sample = load_sample(path, limit)
+    print(f"Fragments: {len(sample)}")
+
+    for name, new, old in (
+        ("wiki", clean_wiki_text, reference_wiki_text),
+        ("news", clean_news_text, reference_news_text),
+    ):
+        mismatches = sum(1 for text in sample if new(text) != old(text))
+        t_old = bench(old, sample)
+        t_new = bench(new, sample)
+        print(
+            f"{name}: reference {t_old:.2f} us/call, new {t_new:.2f} us/call, "
+            f"x{t_old / t_new:.2f}, mismatches: {mismatches}"
+        )
+
+
+if __name__ == "__main__":
+    main()